@@ -0,0 +1,114 @@
+"""
+Circulation reports over catalog counts, computed with NumPy arrays.
+
+Requires numpy, which main.py itself does not need; install it with
+pip install -r requirements-analytics.txt.
+"""
+import numpy as np
+
+from main import LibraryCatalog, ObserverManager
+
+
+class CatalogAnalytics:
+    """
+    Class keeping catalog columns as NumPy arrays and answering aggregate reports on them.
+
+    Constructor parameters:
+     - catalog (LibraryCatalog): Analysed catalog.
+     - manager (ObserverManager): Manager whose waitlists are analysed, None by default.
+
+    Parameters:
+     - catalog (LibraryCatalog): Analysed catalog.
+     - manager (ObserverManager): Manager whose waitlists are analysed or None.
+     - ids (ndarray): Book IDs, in order of catalog storage.
+     - years (ndarray): Publication years.
+     - available (ndarray): Available counts.
+     - total (ndarray): Total counts.
+
+    Methods:
+     - refresh(): Copies current columns of catalog into arrays.
+     - by_year() -> dict(int: tuple(int, int, int)): Returns number of titles, available copies
+    and all copies for every publication year.
+     - on_loan() -> float: Returns fraction of all copies that are lent.
+     - utilization() -> ndarray: Returns fraction of lent copies of every title.
+     - out_of_stock() -> ndarray: Returns IDs of titles without available copy.
+     - top_waitlisted(count: int) -> list(tuple(int, int)): Returns IDs of titles with the
+    longest waitlists and lengths of these waitlists, longest first.
+
+    Arrays are a copy taken by refresh(), so reports do not see later lending until it is called
+    again. With ColumnStore refreshing copies raw arrays, which takes milliseconds even for
+    millions of titles; DictStore has to build its columns first.
+    """
+
+    def __init__(self, catalog: LibraryCatalog, manager: ObserverManager = None):
+        self.catalog = catalog
+        self.manager = manager
+        self.refresh()
+
+    def refresh(self):
+        """
+        Copies catalog columns.
+        """
+        _, ids, years, available, total = self.catalog.store.columns()
+        # Copies, because NumPy view would forbid storage from growing its arrays
+        self.ids = np.array(ids, dtype=np.int64)
+        self.years = np.array(years, dtype=np.int32)
+        self.available = np.array(available, dtype=np.int64)
+        self.total = np.array(total, dtype=np.int64)
+
+    def by_year(self) -> dict:
+        """
+        Sums titles and copies by publication year.
+        """
+        if not len(self.years):
+            return {}
+        first = int(self.years.min())
+        offsets = self.years - first
+        titles = np.bincount(offsets)
+        available = np.bincount(offsets, weights=self.available)
+        total = np.bincount(offsets, weights=self.total)
+        return {
+            first + int(i): (int(titles[i]), int(available[i]), int(total[i]))
+            for i in np.flatnonzero(titles)
+        }
+
+    def on_loan(self) -> float:
+        """
+        Counts fraction of lent copies.
+        """
+        copies = int(self.total.sum())
+        if copies < 1:
+            return 0.0
+        return 1 - int(self.available.sum()) / copies
+
+    def utilization(self) -> np.ndarray:
+        """
+        Counts fraction of lent copies of every title.
+        """
+        lent = (self.total - self.available).astype(np.float64)
+        return np.divide(
+            lent, self.total, out=np.zeros_like(lent), where=self.total > 0
+        )
+
+    def out_of_stock(self) -> np.ndarray:
+        """
+        Finds titles without available copy.
+        """
+        return self.ids[self.available < 1]
+
+    def top_waitlisted(self, count: int = 10) -> list:
+        """
+        Finds titles with the longest waitlists.
+        """
+        if self.manager is None or not self.manager.waiters:
+            return []
+        waiters = list(self.manager.waiters.items())
+        ids = np.fromiter((i for i, _ in waiters), dtype=np.int64, count=len(waiters))
+        lengths = np.fromiter(
+            (len(i) for _, i in waiters), dtype=np.int64, count=len(waiters)
+        )
+        count = min(count, len(lengths))
+        best = np.argpartition(-lengths, count - 1)[:count]
+        # Ties keep ID order, so the report is stable
+        best = best[np.lexsort((ids[best], -lengths[best]))]
+        return [(int(ids[i]), int(lengths[i])) for i in best]
@@ -0,0 +1,64 @@
+"""
+Test file for analytics.py; use with pytest. Skipped when numpy is not installed.
+"""
+import pytest
+
+pytest.importorskip("numpy")
+
+from analytics import CatalogAnalytics  # noqa: E402
+from main import (  # noqa: E402
+    ActionInterface,
+    Book,
+    ColumnStore,
+    LibraryCatalog,
+    ObserverManager,
+    UserFactory,
+)
+
+cat = LibraryCatalog()
+factory = UserFactory()
+
+
+class Tester:
+    """
+    Class running tests. Use with pytest.
+    """
+
+    def test_1_reports(self):
+        """
+        Test 1.
+        """
+        expect = [
+            {2000: (2, 2, 4), 2010: (1, 0, 1)},
+            0.6,
+            [0.0, 0.666667, 1.0],
+            [3],
+            [(3, 2), (2, 1)],
+        ]
+        saved = cat.store
+        cat.use_store(ColumnStore())
+        desk = ActionInterface(cat, ObserverManager())
+        desk.add_books(
+            [Book("First", 1, 2000)]
+            + [Book("Second", 2, 2000)] * 3
+            + [Book("Third", 3, 2010)]
+        )
+        users = [factory.create_user("student", f"AN{i}") for i in range(3)]
+        desk.borrow_book(users[0], 2)
+        desk.borrow_book(users[0], 3)
+        desk.borrow_book(users[1], 3)
+        desk.borrow_book(users[2], 3)
+        desk.borrow_book(users[1], 2)
+        desk.borrow_book(users[2], 2)
+        desk.return_book(users[2], 2)
+        desk.borrow_book(users[1], 1)
+        desk.return_book(users[1], 1)
+        desk.manager.attach(users[0], Book("Second", 2, 2000))
+        report = CatalogAnalytics(cat, desk.manager)
+        got = [report.by_year(), round(report.on_loan(), 6)]
+        got.append([round(float(i), 6) for i in report.utilization()])
+        got.append(report.out_of_stock().tolist())
+        got.append(report.top_waitlisted(2))
+        cat.use_store(saved)
+        assert expect == got
+        print("Test 1 - reports")
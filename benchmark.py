@@ -0,0 +1,366 @@
+"""
+Benchmarks for main.py; run with python benchmark.py.
+
+Every benchmark runs at chosen scales (10^3 to 10^6 items) on synthetic books and users, in a
+fresh process, and prints one json line per result. With --repeat, every benchmark runs that
+many times and only its best result is kept, which hides most of the noise of short runs.
+Results can be saved as baseline with --save-baseline and later compared with --baseline; the
+script exits with status 1 when any result is worse than baseline by more than --tolerance.
+
+benchmark_baseline.json holds small-scale results; check against it with:
+
+    python benchmark.py --scale 1000 --repeat 5 --tolerance 0.5 --baseline benchmark_baseline.json
+
+Timings depend on the machine, so refresh it on yours first with:
+
+    python benchmark.py --scale 1000 --repeat 5 --save-baseline benchmark_baseline.json
+"""
+import argparse
+import csv
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from main import (
+    Book,
+    ColumnStore,
+    DataAdapter,
+    DictStore,
+    LibraryCatalog,
+    ObserverManager,
+    UserFactory,
+)
+
+STORES = {"dict": DictStore, "column": ColumnStore}
+
+
+def rss_bytes() -> int:
+    """
+    Returns resident set size of this process.
+    """
+    try:
+        with open("/proc/self/statm", "r", encoding="utf-8") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak size is the best estimate available outside Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def make_books(count: int) -> list:
+    """
+    Generates synthetic books with unique IDs.
+    """
+    return [Book(f"Title {i}", i, 1900 + i % 120) for i in range(count)]
+
+
+def make_users(count: int) -> list:
+    """
+    Generates synthetic users of every type.
+    """
+    factory = UserFactory()
+    kinds = ["student", "teacher", "librarian"]
+    return [factory.create_user(kinds[i % 3], f"User {i}") for i in range(count)]
+
+
+def make_catalog(store: str, books: list) -> LibraryCatalog:
+    """
+    Fills catalog with fresh storage of given type with one copy of every book.
+    """
+    catalog = LibraryCatalog()
+    catalog.use_store(STORES[store]())
+    catalog.journal = None
+    for book in books:
+        catalog.add_book(book)
+    return catalog
+
+
+def result(name: str, store: str, scale: int, seconds: float, operations: int) -> dict:
+    """
+    Builds result of timed benchmark.
+    """
+    return {
+        "benchmark": name,
+        "store": store,
+        "scale": scale,
+        "seconds": round(seconds, 6),
+        "value": round(operations / seconds, 1),
+        "unit": "ops/s",
+    }
+
+
+def bench_memory(store: str, scale: int) -> dict:
+    """
+    Fills empty store with synthetic titles and measures growth of resident set size.
+    """
+    catalog = STORES[store]()
+    before = rss_bytes()
+    for i in range(scale):
+        catalog.insert(Book(f"Title {i}", i, 1900 + i % 120), 1 + i % 3)
+    grown = rss_bytes() - before
+    return {
+        "benchmark": "memory",
+        "store": store,
+        "scale": scale,
+        "rss_bytes": grown,
+        "value": round(grown / scale, 1),
+        "unit": "B/title",
+    }
+
+
+def bench_add_book(store: str, scale: int) -> dict:
+    """
+    Adds new titles and then second copies of them.
+    """
+    books = make_books(scale)
+    catalog = make_catalog(store, [])
+    start = time.perf_counter()
+    for book in books:
+        catalog.add_book(book)
+    for book in books:
+        catalog.add_book(book)
+    return result("add_book", store, scale, time.perf_counter() - start, 2 * scale)
+
+
+def bench_borrow_book(store: str, scale: int) -> dict:
+    """
+    Borrows every title once, each by a different user.
+    """
+    catalog = make_catalog(store, make_books(scale))
+    users = make_users(scale)
+    manager = ObserverManager()
+    start = time.perf_counter()
+    for identify, user in enumerate(users):
+        catalog.borrow_book(user, identify, manager)
+    return result("borrow_book", store, scale, time.perf_counter() - start, scale)
+
+
+def bench_return_book(store: str, scale: int) -> dict:
+    """
+    Returns every borrowed title.
+    """
+    catalog = make_catalog(store, make_books(scale))
+    users = make_users(scale)
+    manager = ObserverManager()
+    for identify, user in enumerate(users):
+        catalog.borrow_book(user, identify, manager)
+    start = time.perf_counter()
+    for identify, user in enumerate(users):
+        catalog.return_book(user, identify, manager)
+    return result("return_book", store, scale, time.perf_counter() - start, scale)
+
+
+def bench_get_next(store: str, scale: int) -> dict:
+    """
+    Walks through whole catalog with get_next().
+    """
+    catalog = make_catalog(store, make_books(scale))
+    catalog.current = 0
+    start = time.perf_counter()
+    for _ in range(scale):
+        catalog.get_next()
+    return result("get_next", store, scale, time.perf_counter() - start, scale)
+
+
+def bench_notify(store: str, scale: int) -> dict:
+    """
+    Notifies waitlist of one book with scale observers.
+    """
+    book = Book("Wanted", 0, 2000)
+    manager = ObserverManager()
+    for user in make_users(scale):
+        manager.attach(user, book)
+    start = time.perf_counter()
+    manager.notify(book)
+    return result("notify", store, scale, time.perf_counter() - start, scale)
+
+
+def bench_snapshot_load(store: str, scale: int) -> dict:
+    """
+    Loads catalog from snapshot saved in temporary file.
+    """
+    catalog = make_catalog(store, make_books(scale))
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "catalog.bin")
+        catalog.save_snapshot(path, [])
+        start = time.perf_counter()
+        catalog.load_snapshot(path)
+        seconds = time.perf_counter() - start
+    return result("snapshot_load", store, scale, seconds, scale)
+
+
+def write_books(path: str, books: list):
+    """
+    Writes books to file in format chosen by extension.
+    """
+    extension = os.path.splitext(path)[1]
+    with open(path, "w", encoding="utf-8") as f:
+        if extension == ".xml":
+            f.write("<books>\n")
+            for i in books:
+                f.write(
+                    f"<book><name>{i.name}</name><id>{i.identify}</id>"
+                    f"<year>{i.year}</year></book>\n"
+                )
+            f.write("</books>\n")
+        elif extension == ".csv":
+            f.write("name,id,year\n")
+            for i in books:
+                f.write(f"{i.name},{i.identify},{i.year}\n")
+        elif extension == ".json":
+            rows = [{"name": i.name, "id": i.identify, "year": i.year} for i in books]
+            json.dump({"books": rows}, f)
+        else:
+            for i in books:
+                f.write(json.dumps({"name": i.name, "id": i.identify, "year": i.year}))
+                f.write("\n")
+
+
+def bench_reader(extension: str):
+    """
+    Creates benchmark of DataAdapter reading file with given extension.
+    """
+
+    def bench(store: str, scale: int) -> dict:
+        catalog = make_catalog(store, [])
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "books" + extension)
+            write_books(path, make_books(scale))
+            start = time.perf_counter()
+            DataAdapter().read(catalog, path)
+            seconds = time.perf_counter() - start
+        return result(
+            "read" + extension.replace(".", "_"), store, scale, seconds, scale
+        )
+
+    return bench
+
+
+def dictreader_records(filename: str):
+    """
+    Yields books from csv file with csv.DictReader, like DataAdapter did before its chunked
+    reader.
+    """
+    with open(filename, mode="r", encoding="utf-8", newline="") as csvfile:
+        for row in csv.DictReader(csvfile):
+            try:
+                yield Book(row["name"], int(row["id"]), int(row["year"])), 1
+            except (TypeError, IndexError):
+                yield None
+
+
+def bench_csv_parser(name: str, records):
+    """
+    Creates benchmark of parsing csv file into books without adding them to catalog.
+    """
+
+    def bench(store: str, scale: int) -> dict:
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "books.csv")
+            write_books(path, make_books(scale))
+            start = time.perf_counter()
+            for _ in records(path):
+                pass
+            seconds = time.perf_counter() - start
+        return result(name, store, scale, seconds, scale)
+
+    return bench
+
+
+BENCHMARKS = {
+    "memory": bench_memory,
+    "add_book": bench_add_book,
+    "borrow_book": bench_borrow_book,
+    "return_book": bench_return_book,
+    "get_next": bench_get_next,
+    "notify": bench_notify,
+    "snapshot_load": bench_snapshot_load,
+    "read_xml": bench_reader(".xml"),
+    "read_csv": bench_reader(".csv"),
+    "parse_csv": bench_csv_parser("parse_csv", DataAdapter().records_csv),
+    "parse_csv_dictreader": bench_csv_parser(
+        "parse_csv_dictreader", dictreader_records
+    ),
+    "read_json": bench_reader(".json"),
+    "read_jsonl": bench_reader(".jsonl"),
+}
+
+
+def run(name: str, store: str, scale: int) -> dict:
+    """
+    Runs one benchmark; used as target of worker process.
+    """
+    return BENCHMARKS[name](store, scale)
+
+
+def best(results: list) -> dict:
+    """
+    Returns the best of repeated results of one benchmark.
+    """
+    if results[0]["unit"] == "ops/s":
+        return max(results, key=lambda i: i["value"])
+    return min(results, key=lambda i: i["value"])
+
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    """
+    Returns results worse than their baseline by more than tolerance.
+    """
+    known = {(i["benchmark"], i["store"], i["scale"]): i for i in baseline}
+    worse = []
+    for i in results:
+        base = known.get((i["benchmark"], i["store"], i["scale"]))
+        if base is None:
+            continue
+        if i["unit"] == "ops/s":
+            ratio = base["value"] / i["value"] if i["value"] else float("inf")
+        else:
+            ratio = i["value"] / base["value"] if base["value"] else float("inf")
+        if ratio > 1 + tolerance:
+            worse.append(dict(i, baseline=base["value"], slowdown=round(ratio, 2)))
+    return worse
+
+
+def main():
+    """
+    Runs benchmarks chosen in command line and prints results as json lines.
+    """
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--scale", type=int, action="append")
+    parser.add_argument("--store", choices=list(STORES), action="append")
+    parser.add_argument("--bench", choices=list(BENCHMARKS), action="append")
+    parser.add_argument("--baseline", help="file with results to compare against")
+    parser.add_argument("--save-baseline", help="file to save results to")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+    results = []
+    for scale in args.scale or [1_000, 10_000, 100_000]:
+        for name in args.bench or list(BENCHMARKS):
+            for store in args.store or list(STORES):
+                runs = []
+                for _ in range(args.repeat):
+                    # Fresh process for every run, so leftovers of others do not count
+                    with ProcessPoolExecutor(max_workers=1) as executor:
+                        runs.append(executor.submit(run, name, store, scale).result())
+                results.append(best(runs))
+                print(json.dumps(results[-1]), flush=True)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            worse = compare(results, json.load(f), args.tolerance)
+        for i in worse:
+            print(json.dumps(dict(i, regression=True)), flush=True)
+        if worse:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Test file for benchmark.py; use with pytest.
+"""
+from benchmark import best, compare
+
+
+def result(name: str, value: float, unit: str) -> dict:
+    """
+    Builds result like the ones benchmarks return.
+    """
+    return {
+        "benchmark": name,
+        "store": "dict",
+        "scale": 1000,
+        "value": value,
+        "unit": unit,
+    }
+
+
+class Tester:
+    """
+    Class running tests. Use with pytest.
+    """
+
+    def test_1_compare(self):
+        """
+        Test 1.
+        """
+        expect = [
+            [("add_book", 2.0), ("memory", 2.0)],
+            [],
+            [("add_book", float("inf"))],
+        ]
+        baseline = [
+            result("add_book", 1000, "ops/s"),
+            result("borrow_book", 1000, "ops/s"),
+            result("memory", 100, "B/title"),
+            result("notify", 100, "B/title"),
+        ]
+        # Fewer operations per second and more bytes per title are both worse
+        results = [
+            result("add_book", 500, "ops/s"),
+            result("borrow_book", 2000, "ops/s"),
+            result("memory", 200, "B/title"),
+            result("notify", 50, "B/title"),
+            result("get_next", 1, "ops/s"),
+        ]
+        got = [
+            [(i["benchmark"], i["slowdown"]) for i in compare(results, baseline, 0.25)]
+        ]
+        # Slowdown within tolerance is not reported
+        got.append(compare(results, baseline, 1.5))
+        got.append(
+            [
+                (i["benchmark"], i["slowdown"])
+                for i in compare([result("add_book", 0, "ops/s")], baseline, 0.25)
+            ]
+        )
+        assert expect == got
+        print("Test 1 - compare")
+
+    def test_2_best(self):
+        """
+        Test 2.
+        """
+        expect = [300, 100]
+        got = [
+            best([result("add_book", i, "ops/s") for i in (200, 300, 100)])["value"],
+            best([result("memory", i, "B/title") for i in (200, 300, 100)])["value"],
+        ]
+        assert expect == got
+        print("Test 2 - best")
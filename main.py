@@ -2,9 +2,29 @@
 File containing classes representing various design patterns for library system.
 """
 import abc
+import asyncio
+import bisect
 import csv
+import heapq
+import io
+import itertools
 import json
+import mmap
+import multiprocessing
+import os
+import queue
+import re
+import sqlite3
+import struct
+import sys
+import threading
+import time
 import xml.etree.ElementTree as ET
+from array import array
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import escape
 
 
 class Book:
@@ -15,13 +35,31 @@ class Book:
      - name (str): Book name.
      - identify (int): Book ID.
      - year (int): Book year publication.
+
+    Notes:
+     * Books with the same name, ID and year are equal, so a book rebuilt from compact storage can
+    be used in place of the original one.
     """
 
+    __slots__ = ("name", "identify", "year")
+
     def __init__(self, name: str, identify: int, year: int):
         self.name = name
         self.identify = identify
         self.year = year
 
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Book):
+            return NotImplemented
+        return (self.name, self.identify, self.year) == (
+            other.name,
+            other.identify,
+            other.year,
+        )
+
+    def __hash__(self) -> int:
+        return hash((self.name, self.identify, self.year))
+
     def __str__(self) -> str:
         return f"{self.name}, {self.year}, id {self.identify}"
 
@@ -42,10 +80,20 @@ class User(abc.ABC):
      - limit (int): Book limit.
      - books (dict(Book: str))): Dictionary containing books and their statuses - "Ordered" or
      "Borrowed"
+     - loans (dict(int: Book)): Books of user by their IDs.
+     - statuses (dict(str: int)): Number of user's books in every status.
+     - identify (int): User ID given by UserRegistry, None if user is not registered.
 
     Methods:
      - get_limit -> int: Returns book limit.
      - get_name -> str: Returns user's name.
+     - loan(identify: int) -> Book: Returns user's book with given ID or None.
+     - set_loan(book: Book, status: str): Adds book to user's list or changes its status.
+     - remove_loan(book: Book): Removes book from user's list.
+     - count(status: str) -> int: Returns number of user's books in given status.
+
+    books, loans and statuses should be changed only with set_loan() and remove_loan(), so they
+    stay consistent.
     """
 
     @abc.abstractmethod
@@ -53,6 +101,9 @@ class User(abc.ABC):
         self.name = name
         self.limit = 0
         self.books: dict[Book, str] = {}
+        self.loans: dict[int, Book] = {}
+        self.statuses: dict[str, int] = {}
+        self.identify = None
         # raise NotImplementedError("User is supposed to be an abstract class")
 
     def get_limit(self) -> int:
@@ -67,6 +118,36 @@ class User(abc.ABC):
         """
         return self.name
 
+    def loan(self, identify: int) -> Book:
+        """
+        Finds user's book by its ID.
+        """
+        return self.loans.get(identify)
+
+    def set_loan(self, book: Book, status: str):
+        """
+        Sets status of user's book.
+        """
+        previous = self.books.get(book)
+        if previous is not None:
+            self.statuses[previous] -= 1
+        self.books[book] = status
+        self.loans[book.identify] = book
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def remove_loan(self, book: Book):
+        """
+        Removes book from user's list.
+        """
+        self.statuses[self.books.pop(book)] -= 1
+        del self.loans[book.identify]
+
+    def count(self, status: str) -> int:
+        """
+        Counts user's books in given status.
+        """
+        return self.statuses.get(status, 0)
+
 
 class Student(User):
     """
@@ -83,9 +164,8 @@ class Student(User):
     """
 
     def __init__(self, name: str):
-        self.name = name
+        super().__init__(name)
         self.limit = 5
-        self.books = {}
 
 
 class Teacher(User):
@@ -103,9 +183,8 @@ class Teacher(User):
     """
 
     def __init__(self, name: str):
-        self.name = name
+        super().__init__(name)
         self.limit = 15
-        self.books = {}
 
 
 class Librarian(User):
@@ -123,9 +202,34 @@ class Librarian(User):
     """
 
     def __init__(self, name: str):
-        self.name = name
+        super().__init__(name)
         self.limit = 25
-        self.books = {}
+
+
+# Concurrency
+class LockStripes:
+    """
+    Class representing fixed set of locks shared by keys. Operations on different keys rarely
+    wait for each other, while number of locks does not grow with number of keys.
+
+    Constructor parameters:
+     - count (int): Number of locks.
+
+    Parameters:
+     - locks (list(Lock)): Locks.
+
+    Methods:
+     - get(key) -> Lock: Returns lock of given key.
+    """
+
+    def __init__(self, count: int = 64):
+        self.locks = [threading.Lock() for _ in range(count)]
+
+    def get(self, key) -> threading.Lock:
+        """
+        Finds lock of given key.
+        """
+        return self.locks[hash(key) % len(self.locks)]
 
 
 # Observer
@@ -136,28 +240,71 @@ class Observer:
     Constructor parameters:
      - user (User): Reference to user who awaits book.
      - book (Book): Observed book.
+     - capacity (int): Number of newest notifications kept, 100 by default.
 
     Parameters:
      - user (User): Reference to user who awaits book.
+     - wishlist (dict(int: Book)): Observed books by their IDs.
      - books (list(Book)): List of observed books.
-     - infos (list(str)): A list of notification sent to user.
+     - events (deque(tuple(str, Book, float))): Newest notifications as event type, book and
+    time, older ones are dropped.
+     - received (int): Number of all notifications sent to user.
+     - seen (int): Number of notifications already read with get_unread().
+     - infos (list(str)): A list of kept notifications sent to user, formatted.
 
     Methods:
-     - update(text: str) -> str: Adds new notification.
-     - get_infos() -> list: Returns all notifications.
+     - update(event: str, book: Book) -> tuple(str, Book, float): Adds new notification of given
+    type (see MESSAGES) and returns it.
+     - format(event: tuple(str, Book, float)) -> str: Returns notification as text.
+     - get_infos() -> list: Returns all kept notifications.
+     - get_unread() -> list: Returns kept notifications not read yet and marks them as read.
+
+    Notifications are stored as small tuples sharing book objects with catalog and turned into
+    text only when read, so memory of observer does not grow with its lifetime.
     """
 
-    def __init__(self, user: User, book: Book):
+    MESSAGES = {
+        "wishlisted": "User {} wishlisted book {}.",
+        "added": "User: {} added book {} to wishlist.",
+        "available": "User {} - book {} is available.",
+        "reserved": "User {} - book {} is reserved for you.",
+    }
+
+    def __init__(self, user: User, book: Book, capacity: int = 100):
         self.user = user
-        self.books = [book]
-        self.infos: list[str] = []
+        self.wishlist: dict[int, Book] = {book.identify: book}
+        self.events = deque(maxlen=capacity)
+        self.received = 0
+        self.seen = 0
+
+    @property
+    def books(self) -> list:
+        """
+        Shows observed books.
+        """
+        return list(self.wishlist.values())
+
+    @property
+    def infos(self) -> list:
+        """
+        Shows all kept notifications.
+        """
+        return [self.format(i) for i in self.events]
 
-    def update(self, text: str) -> str:
+    def update(self, event: str, book: Book) -> tuple:
         """
         Adds new notification.
         """
-        self.infos.append(text)
-        return text
+        item = (event, book, time.time())
+        self.events.append(item)
+        self.received += 1
+        return item
+
+    def format(self, event: tuple) -> str:
+        """
+        Formats notification.
+        """
+        return self.MESSAGES[event[0]].format(self.user.name, event[1])
 
     def get_infos(self) -> list:
         """
@@ -165,6 +312,14 @@ class Observer:
         """
         return self.infos
 
+    def get_unread(self) -> list:
+        """
+        Shows unread notifications.
+        """
+        unread = min(self.received - self.seen, len(self.events))
+        self.seen = self.received
+        return [self.format(self.events[i]) for i in range(-unread, 0)]
+
 
 class ObserverManager:
     """
@@ -172,6 +327,24 @@ class ObserverManager:
 
     Parameters:
      - observers (list(Observer)): List of observers.
+     - users (dict(str: Observer)): Observers by their user's name.
+     - waiters (dict(int: dict(str: Observer))): Observers waiting for each book ID, in order of
+    attaching.
+     - journal (Journal): Journal recording changes of waitlists, None by default.
+     - user_locks (LockStripes): Locks of users.
+     - book_locks (LockStripes): Locks of waitlists of books.
+     - capacity (int): Number of notifications kept by every observer.
+     - listeners (list(callable)): Functions called with user and text of every notification.
+     - dispatcher (NotificationDispatcher): Dispatcher delivering notifications of available
+    books in background, None by default.
+     - reservations (bool): Whether returned copies are held for one waiter instead of
+    notifying all of them.
+     - queues (dict(int: list(tuple(int, int, str)))): Heaps of waiters of every book ID as
+    rank, order of waiting and user's name, used in reservation mode.
+     - tickets (dict(tuple(int, str): int)): Order of waiting of every book ID and user's name
+    still in queue; heap entries without matching ticket are skipped.
+     - holds (dict(int: dict(str: Book))): Reserved copies of every book ID by names of users
+    they are held for.
 
     Methods:
      - attach(user: User, book: Book) -> int: Tries to create a new observer from given user and
@@ -179,364 +352,2766 @@ class ObserverManager:
     list and returns 0 if user is one or returns -1 if user has already been waiting for this book.
      - deattach(user: User, book: Book) -> int: Tries to remove book from user's observer instance.
     Removes this book and returns 1 if the book is in observer's list, return 0 if observer has no
-    book in list, returns -1 if book is not in observer's list or returns -2 if given user is not
-    observer.
-     - notify(book: Book): Notifies proper observers that their book is currently available.
+    book in list, returns -1 if book is not in observer's list, returns -2 if given user is not
+    observer or -3 if a copy of book is held for user (LibraryCatalog.release() gives it up).
+     - wait(user: User, book: Book) -> Observer: Adds book to user's wishlist like attach() does,
+    but without any notification. Used to restore saved waitlists.
+     - unwait(user: User, book: Book): Removes book from user's wishlist without any checks.
+     - notify(book: Book): Notifies proper observers that their book is currently available. With
+    dispatcher, only queues the book and returns at once.
+     - broadcast(book: Book): Notifies observers of book right away, used by notify() and
+    dispatcher.
+     - publish(observer: Observer, event: str, book: Book): Adds notification to observer and
+    passes its text to listeners.
+     - rank(user: User) -> int: Returns place of user in reservation queues, lower goes first.
+    Users with higher book limit go first (librarians, then teachers, then students).
+     - hold(book: Book) -> Observer: Takes the first waiter of book from queue, removes book from
+    its wishlist, keeps a copy for it and notifies only this waiter. Returns its observer or None
+    if nobody waits.
+     - keep(user: User, book: Book): Keeps a copy for user like hold() does, but without any
+    notification. Used to restore saved holds.
+     - claim(user: User, book: Book) -> bool: Removes hold of user on book. Returns True if there
+    was one.
+
+    In reservation mode LibraryCatalog calls hold() for every returned copy instead of notify(),
+    so only one user is told about it and nobody races for the copy. Held copies are not counted
+    as available, so nobody else can borrow them. Holds do not expire.
+
+    Methods are safe to call from many threads. attach() and deattach() lock given user and book,
+    notify() locks only the waitlist of given book while copying it, so operations on different
+    users and books do not wait for each other. Locks of users are always taken before locks of
+    books.
 
     Notes:
      * Why Observer? It gives an opportunity to create an automated system that sends information
     about books to interested users as soon as possible.
     """
 
-    def __init__(self):
+    def __init__(self, capacity: int = 100, reservations: bool = False):
         self.observers = []
+        self.capacity = capacity
+        self.users: dict[str, Observer] = {}
+        self.waiters: dict[int, dict[str, Observer]] = {}
+        self.journal = None
+        self.user_locks = LockStripes()
+        self.book_locks = LockStripes()
+        self.listeners = []
+        self.dispatcher = None
+        self.reservations = reservations
+        self.queues: dict[int, list] = {}
+        self.tickets: dict[tuple, int] = {}
+        self.holds: dict[int, dict[str, Book]] = {}
+        self.sequence = itertools.count()
 
     def attach(self, user: User, book: Book) -> int:
         """
         Tries to create new observer from given user and book.
         """
-        for i in self.observers:
-            if i.user.name == user.name:
-                for j in i.books:
-                    if j.identify == book.identify:
-                        i.update(f"User: {i.user.name} already wishlisted book {book}.")
-                        return -1
-                i.books.append(book)
-                i.update(f"User: {i.user.name} added book {book} to wishlist.")
-                return 0
-        self.observers.append(Observer(user, book))
-        self.observers[-1].update(
-            f"User {self.observers[-1].user.name} wishlisted book {book}."
-        )
-        return 1
+        with self.user_locks.get(user.name), self.book_locks.get(book.identify):
+            i = self.users.get(user.name)
+            if i is not None and book.identify in i.wishlist:
+                # Repeated wish is only refused, it is not worth a notification
+                return -1
+            if self.journal is not None:
+                self.journal.record("W", user, book)
+            if i is None:
+                i = self.wait(user, book)
+                self.publish(i, "wishlisted", book)
+                return 1
+            self.wait(user, book)
+            self.publish(i, "added", book)
+            return 0
+
+    def wait(self, user: User, book: Book) -> Observer:
+        """
+        Adds given book to given user's wishlist without any notification.
+        """
+        i = self.users.get(user.name)
+        if i is None:
+            i = Observer(user, book, self.capacity)
+            self.observers.append(i)
+            self.users[user.name] = i
+        else:
+            i.wishlist[book.identify] = book
+        self.waiters.setdefault(book.identify, {})[user.name] = i
+        if self.reservations:
+            ticket = next(self.sequence)
+            self.tickets[book.identify, user.name] = ticket
+            heapq.heappush(
+                self.queues.setdefault(book.identify, []),
+                (self.rank(user), ticket, user.name),
+            )
+        return i
+
+    def unwait(self, user: User, book: Book):
+        """
+        Removes given book from given user's wishlist without any checks.
+        """
+        del self.users[user.name].wishlist[book.identify]
+        # Remove observer from book's waitlist
+        waiting = self.waiters[book.identify]
+        del waiting[user.name]
+        if not waiting:
+            del self.waiters[book.identify]
+        self.tickets.pop((book.identify, user.name), None)
 
     def deattach(self, user: User, book: Book) -> int:
         """
         Removes given book from given user's wishlist.
         """
-        for i in self.observers:
-            if i.user.name == user.name:
-                if len(user.books) < 1:
-                    # User has no book in wishlist
-                    return 0
-                for j in i.books:
-                    if j.identify == book.identify:
-                        # Remove book from wishlist
-                        i.books.remove(j)
-                        return 1
+        with self.user_locks.get(user.name), self.book_locks.get(book.identify):
+            i = self.users.get(user.name)
+            if i is None:
+                # Observer not found
+                return -2
+            if user.name in self.holds.get(book.identify, {}):
+                # Copy is held for user, LibraryCatalog.release() gives it up
+                return -3
+            if len(user.books) < 1:
+                # User has no book in wishlist
+                return 0
+            if book.identify not in i.wishlist:
                 # Book not found in wishlist
                 return -1
-        # Observer not found
-        return -2
+            if self.journal is not None:
+                self.journal.record("U", user, book)
+            self.unwait(user, book)
+            return 1
 
     def notify(self, book):
         """
         Notifies observers about given book's availability.
         """
-        for i in self.observers:
-            for j in i.books:
-                if j.identify == book.identify:
-                    # Inform observer
-                    i.update(f"User {i.user.name} - book {book} is available.")
-                    break
+        if self.dispatcher is not None:
+            self.dispatcher.submit(self, book)
+        else:
+            self.broadcast(book)
+
+    def broadcast(self, book):
+        """
+        Notifies observers about given book's availability right away.
+        """
+        with self.book_locks.get(book.identify):
+            waiting = list(self.waiters.get(book.identify, {}).values())
+        for i in waiting:
+            # Inform observer
+            self.publish(i, "available", book)
 
+    def publish(self, observer: Observer, event: str, book: Book):
+        """
+        Sends notification to observer and listeners.
+        """
+        item = observer.update(event, book)
+        if self.listeners:
+            text = observer.format(item)
+            for listener in self.listeners:
+                listener(observer.user, text)
 
-# Singleton + Iterator
-class LibraryCatalog:
+    def rank(self, user: User) -> int:
+        """
+        Shows place of user in reservation queues.
+        """
+        return -user.limit
+
+    def hold(self, book: Book) -> Observer:
+        """
+        Keeps a copy of book for its first waiter.
+        """
+        while True:
+            with self.book_locks.get(book.identify):
+                queue = self.queues.get(book.identify)
+                # Users who stopped waiting stay in heap until they reach its top
+                while queue and self.tickets.get((book.identify, queue[0][2])) != (
+                    queue[0][1]
+                ):
+                    heapq.heappop(queue)
+                if not queue:
+                    self.queues.pop(book.identify, None)
+                    return None
+                first = queue[0]
+            # Lock of user must be taken first, so check again that nothing changed
+            with self.user_locks.get(first[2]), self.book_locks.get(book.identify):
+                queue = self.queues.get(book.identify)
+                if not queue or queue[0] != first:
+                    continue
+                heapq.heappop(queue)
+                i = self.users[first[2]]
+                if self.journal is not None:
+                    self.journal.record("H", i.user, book)
+                self.keep(i.user, book)
+            self.publish(i, "reserved", book)
+            return i
+
+    def keep(self, user: User, book: Book):
+        """
+        Keeps a copy of book for given user without any notification.
+        """
+        i = self.users.get(user.name)
+        if i is None:
+            i = self.wait(user, book)
+        if book.identify in i.wishlist:
+            self.unwait(user, book)
+        self.holds.setdefault(book.identify, {})[user.name] = book
+
+    def claim(self, user: User, book: Book) -> bool:
+        """
+        Removes hold of user on book.
+        """
+        with self.user_locks.get(user.name), self.book_locks.get(book.identify):
+            held = self.holds.get(book.identify)
+            if not held or user.name not in held:
+                return False
+            del held[user.name]
+            if not held:
+                del self.holds[book.identify]
+            return True
+
+
+class NotificationDispatcher:
     """
-    Class representing book catalog in library.
-    It uses Singleton pattern design (one catalog is enough)
-    and Iterator (to show next books in catalog).
+    Class delivering notifications about available books in worker threads, so returning a book
+    does not wait for its whole waitlist to be informed.
 
     Constructor parameters:
-    None
+     - workers (int): Number of worker threads, 2 by default.
+     - size (int): Maximum number of queued books, 1024 by default.
+     - batch (int): Maximum number of queued books taken by worker at once, 64 by default.
 
     Parameters:
-     - instance (LibraryCatalog): Singleton instance.
-     - catalog (dict(Book: list(int, int))): Dictionary with books in catalog, their available
-    count and total count.
-     - current (int): Index used for Iterator design pattern in get_next() method.
+     - events (Queue): Queued pairs of manager and book.
+     - threads (list(Thread)): Worker threads.
+     - batch (int): Maximum number of queued books taken by worker at once.
+     - submitted (int): Number of queued books.
+     - delivered (int): Number of books whose observers were notified.
+     - coalesced (int): Number of queued books skipped, because the same book was earlier in
+    the same batch.
+     - failed (int): Number of books whose delivery raised an exception.
+     - peak (int): Greatest number of books waiting in queue.
+     - lock (Lock): Lock guarding counters.
+     - closed (bool): Whether shutdown() was called.
+     - entering (int): Number of submit() calls that passed the gate and are still queuing.
+     - gate (Condition): Condition guarding closed and entering, so shutdown() waits for books
+    being queued before stopping workers.
 
     Methods:
-     - get_catalog() -> dict: Returns full catalog.
-     - get_next() -> str: Returns next book in catalog.
-     - add_book(book: Book) -> int: Adds book to catalog. Increases count and returns 1 if book
-    already exists, otherwise returns 2.
-     - borrow_book(user: User, identify: int, manager: ObserverManager) -> int: Tries to find a
-    book by its ID and declare one of copies as ordered by user. Decreases book count and returns
-    1 if user has not reached book limit and book is available, 0 if book is unavailable right
-    now, -1 if user reached book limit, -2 if user already ordered this book or -3 if book does
-    not exist. Informs ObserverManager to notify users.
-     - return_book(user: User, identify: int, manager: ObserverManager) -> int: Tries to find a
-    book by its ID and return it to library. Increases book count, removes it from user's list and
-    returns 1 if the book exists and user has it, -1 if user has no book borrowed, -2 if user has
-    not borrowed this book or -3 if the book does not exist. Informs ObserverManager to notify
-    users.
-     - update_borrow(user: User, identify: int) -> int: Tries to update book's status in user's
-    list from "Ordered" to "Borrowed". Changes status and returns 1 if user has this book and it
-    is "Ordered", -1 if the book is not "Ordered" or -2 if user does not have this book in its
-    list.
-
-    Notes:
-     * Why Singleton? Library needs only one catalog for books. Creating second one may make a
-    mess with searching in two catalog and this would be troublesome.
-     * Why Iterator? Catalog may become very big in time and looking at dictionary of all books
-    can be confusing. By showing one book lineally, user can look at different book every time if
-    catalog is big enough.
+     - submit(manager: ObserverManager, book: Book): Queues book to notify its observers. Waits
+    when queue is full, so producers cannot outrun workers. After shutdown() observers are
+    notified right away instead.
+     - work(): Main loop of worker thread.
+     - flush(): Waits until every queued book has been delivered.
+     - shutdown(): Delivers queued books and stops workers.
+     - metrics() -> dict(str: int): Returns queue depth and counters.
+
+    An exception raised while notifying observers of one book (for example by a listener) is
+    counted as failed and does not stop the worker.
     """
 
-    def __new__(cls):
-        if not hasattr(cls, "instance"):
-            cls.instance = super(LibraryCatalog, cls).__new__(cls)
-            cls.catalog = {}
-            cls.current = 0
-        return cls.instance
-
-    def get_catalog(self) -> dict:
-        """
-        Shows whole catalog.
-        """
-        return self.catalog
-
-    # Iterator
-    def get_next(self) -> str:
+    def __init__(self, workers: int = 2, size: int = 1024, batch: int = 64):
+        self.events = queue.Queue(size)
+        self.batch = batch
+        self.submitted = 0
+        self.delivered = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+        self.closed = False
+        self.entering = 0
+        self.gate = threading.Condition()
+        self.threads = [
+            threading.Thread(target=self.work, daemon=True) for _ in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, manager: ObserverManager, book: Book):
         """
-        Shows one book from catalog.
+        Queues notification about given book.
         """
-        if len(self.get_catalog()) < 1:
-            return "No books in catalog."
-        if self.current == len(self.get_catalog()):
-            self.current = 0
-        self.current += 1
-        book_key = list(self.get_catalog().keys())[self.current - 1]
-        return f"{book_key}, count: {self.catalog[book_key][0]}/{self.catalog[book_key][1]}"
-
-    def add_book(self, book: Book) -> int:
+        with self.gate:
+            closed = self.closed
+            if not closed:
+                self.entering += 1
+        if closed:
+            manager.broadcast(book)
+            return
+        # Put may wait for free space, so it is done outside gate
+        try:
+            self.events.put((manager, book))
+            with self.lock:
+                self.submitted += 1
+                self.peak = max(self.peak, self.events.qsize())
+        finally:
+            with self.gate:
+                self.entering -= 1
+                if not self.entering:
+                    self.gate.notify_all()
+
+    def work(self):
         """
-        Adds given book to catalog.
+        Delivers queued notifications until shutdown.
         """
-        for i in list(self.catalog.keys()):
-            if (i.name, i.identify, i.year) == (book.name, book.identify, book.year):
-                self.catalog[i][0] += 1
-                self.catalog[i][1] += 1
-                return 1
-        self.catalog[book] = [1, 1]
-        return 2
-
-    def borrow_book(self, user: User, identify: int, manager: ObserverManager) -> int:
+        while True:
+            items = [self.events.get()]
+            while items[-1] is not None and len(items) < self.batch:
+                try:
+                    items.append(self.events.get_nowait())
+                except queue.Empty:
+                    break
+            done = set()
+            stop = False
+            for item in items:
+                try:
+                    if item is None:
+                        stop = True
+                        continue
+                    manager, book = item
+                    key = (id(manager), book.identify)
+                    if key in done:
+                        with self.lock:
+                            self.coalesced += 1
+                        continue
+                    done.add(key)
+                    manager.broadcast(book)
+                    with self.lock:
+                        self.delivered += 1
+                except Exception:
+                    with self.lock:
+                        self.failed += 1
+                finally:
+                    self.events.task_done()
+            if stop:
+                return
+
+    def flush(self):
         """
-        Tries to borrow book to user.
+        Waits for queued notifications.
         """
-        if user.limit <= len(user.books):
-            # Max book limit reached
-            return -1
-        for i in list(self.catalog.keys()):
-            if i.identify == identify:
-                for j in list(user.books.keys()):
-                    if j.identify == identify:
-                        # User already has this book
-                        return -2
-                if self.catalog[i][0] < 1:
-                    # Book unavailable right now, add user to observers
-                    manager.attach(user, i)
-                    return 0
-                # Give book to user's list as ordered (not taken yet)
-                user.books[i] = "Ordered"
-                self.catalog[i][0] -= 1
-                manager.deattach(user, i)
-                return 1
-        # This book is not in catalog
-        return -3
+        self.events.join()
 
-    def return_book(self, user: User, identify: int, manager: ObserverManager) -> int:
+    def shutdown(self):
         """
-        Returns book to catalog.
+        Delivers queued notifications and stops workers.
         """
-        if len(user.books) < 1:
-            # What does user want to return?
-            return -1
-        for i in list(self.catalog.keys()):
-            if i.identify == identify:
-                for j in list(user.books.keys()):
-                    if j.identify == identify:
-                        # Everything is in order
-                        del user.books[j]
-                        self.catalog[i][0] += 1
-                        if self.catalog[i][0] == 1:
-                            # Book is available, inform observers
-                            manager.notify(i)
-                        return 1
-                # User did not borrow this book
-                return -2
-        # This book is not in catalog
-        return -3
-
-    def update_borrow(self, user: User, identify: int) -> int:
+        with self.gate:
+            if self.closed:
+                return
+            self.closed = True
+            # Workers keep running meanwhile, so books waiting for free space get queued
+            while self.entering:
+                self.gate.wait()
+        # Batch ends at None, so every worker takes exactly one of them
+        for _ in self.threads:
+            self.events.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def metrics(self) -> dict:
         """
-        Changes book's status.
+        Shows queue depth and counters.
         """
-        for i in list(user.books.keys()):
-            if i.identify == identify:
-                if user.books[i] == "Ordered":
-                    # User took the book
-                    user.books[i] = "Borrowed"
-                    return 1
-                # Book is not ordered (it is probably taken already)
-                return -1
-        # User does not have this book in list
-        return -2
-
-
-# Adapter
-class DataAdapter:
+        with self.lock:
+            return {
+                "depth": self.events.qsize(),
+                "peak": self.peak,
+                "capacity": self.events.maxsize,
+                "submitted": self.submitted,
+                "delivered": self.delivered,
+                "coalesced": self.coalesced,
+                "failed": self.failed,
+            }
+
+
+# Storage
+class CatalogStore(abc.ABC):
     """
-    Class representing Adapter design pattern. Adds books to catalog from given file.
+    Abstract class representing storage of books and their counts used by LibraryCatalog.
+    Books are never removed, so position of every book (order of adding) is stable.
 
     Methods:
-     - read (catalog: LibraryCatalog, filename: str) -> int: Attempts to recognise file type and
-    send it to proper reader fuction. Returns 1/0 if it is xml and made no/any mistake, returns
-    6/5 if it is csv and made no/any mistake, returns 11/10 if it is json and made no/any mistake
-    or return -1 if file type is unknown.
-     - read_xml (catalog: LibraryCatalog, filename: str) -> int: Reads xml file and tries to add
-    found books to catalog. Returns 1 if no mistake made or 0 otherwise.
-     - read_csv (catalog: LibraryCatalog, filename: str) -> int: Reads csv file and tries to add
-    found books to catalog. Returns 6 if no mistake made or 5 otherwise.
-     - read_json (catalog: LibraryCatalog, filename: str) -> int: Reads json file and tries to add
-    found books to catalog. Returns 11 if no mistake made or 10 otherwise.
-
-    Notes:
-     * Why Adapter? It allows to accomodate to various circumstates. Instead of creating one big
-    confusing method that parses everything, adapter divides problem by creating one switch-case
-    problem that sends arguments to proper subfunction and does its job smoothly. And it can be
-    easily developed further.
+     - __len__() -> int: Returns number of titles.
+     - __contains__(book: Book) -> bool: Checks whether book is stored.
+     - find(identify: int) -> Book: Returns first added book with given ID or None.
+     - counts(book: Book) -> tuple(int, int): Returns available and total count of book. Raises
+    KeyError if book is not stored.
+     - insert(book: Book, count: int): Stores new book with count copies.
+     - add(book: Book, available: int, total: int) -> int: Adds given numbers to book counts and
+    returns new available count.
+     - book_at(position: int) -> Book: Returns book at given position.
+     - rows(start: int, stop: int) -> list(tuple(Book, int, int)): Returns books between given
+    positions with their available and total counts.
+     - view() -> dict: Returns dictionary-like catalog of books and their [available, total]
+    counts.
+     - columns() -> tuple(list(str), array, array, array, array): Returns names, IDs, years,
+    available counts and total counts of all books in order of adding.
+     - load(names: list(str), ids: array, years: array, available: array, total: array): Fills
+    empty storage from columns.
     """
 
-    def read(self, catalog: LibraryCatalog, filename: str):
+    @abc.abstractmethod
+    def __len__(self) -> int:
+        pass
+
+    @abc.abstractmethod
+    def __contains__(self, book: Book) -> bool:
+        pass
+
+    @abc.abstractmethod
+    def find(self, identify: int) -> Book:
         """
-        Tries to recognise file extension and read it.
+        Finds book by its ID.
         """
-        if filename.endswith(".xml"):
-            return self.read_xml(catalog, filename)
-        if filename.endswith(".csv"):
-            return self.read_csv(catalog, filename)
-        if filename.endswith(".json"):
-            return self.read_json(catalog, filename)
-        return -1
 
-    def read_xml(self, catalog: LibraryCatalog, filename: str):
+    @abc.abstractmethod
+    def counts(self, book: Book) -> tuple:
         """
-        Adds books to catalog from xml file.
+        Shows book counts.
         """
-        tree = ET.parse(filename)
-        root = tree.getroot()
-        mistakes = 0
-        for book in root.findall("book"):
-            try:
-                book_str = ET.tostring(book)
-                name = book_str.split(b"<name>")[1].split(b"</name>")[0].decode()
-                identify = book_str.split(b"<id>")[1].split(b"</id>")[0].decode()
-                year = book_str.split(b"<year>")[1].split(b"</year>")[0].decode()
-                catalog.add_book(Book(name, int(identify), int(year)))
-            except (TypeError, IndexError):
-                mistakes += 1
-        if mistakes < 1:
-            return 0
-        return 1
 
-    def read_csv(self, catalog: LibraryCatalog, filename: str):
+    @abc.abstractmethod
+    def insert(self, book: Book, count: int):
         """
-        Adds books to catalog from csv file.
+        Stores new book.
         """
-        mistakes = 0
-        with open(filename, mode="r", encoding="utf-8") as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                try:
-                    catalog.add_book(
-                        Book(row["name"], int(row["id"]), int(row["year"]))
-                    )
-                except (TypeError, IndexError):
-                    mistakes += 1
-        if mistakes < 1:
-            return 6
-        return 5
 
-    def read_json(self, catalog: LibraryCatalog, filename: str):
+    @abc.abstractmethod
+    def add(self, book: Book, available: int, total: int) -> int:
         """
-        Adds books to catalog from json file.
+        Changes book counts.
         """
-        mistakes = 0
-        with open(filename, "r", encoding="utf-8") as f:
-            json_data = json.load(f)
-            for book in json_data["books"]:
-                try:
-                    catalog.add_book(
-                        Book(book["name"], int(book["id"]), int(book["year"]))
-                    )
-                except (TypeError, IndexError):
-                    mistakes += 1
-        if mistakes < 1:
-            return 11
-        return 10
-
-
-# Factory
-class UserFactory:
-    """
-    Class implementing Factory design pattern to create new users.
 
-    Methods:
-     - create_user(user: str, name: str) -> User: Tries to create a proper user class. Return
-    Student, Teacher or Librarian class with chosen name or raises Error for different class names.
-     - check_user_type(user: str) -> bool: Checks whether given user type is valid.
+    @abc.abstractmethod
+    def book_at(self, position: int) -> Book:
+        """
+        Finds book by its position.
+        """
 
-    Notes:
-     * Why Factory? It is a simple solution to create multiple various accounts. Now it is obvious
-    what classes are available plus method input can be universal.
-    """
+    def rows(self, start: int, stop: int) -> list:
+        """
+        Shows books between given positions with counts.
+        """
+        rows = []
+        for position in range(start, min(stop, len(self))):
+            book = self.book_at(position)
+            rows.append((book, *self.counts(book)))
+        return rows
 
-    def __init__(self):
-        self.types = ["student", "teacher", "librarian"]
+    def view(self) -> dict:
+        """
+        Shows whole catalog.
+        """
+        return CatalogView(self)
 
-    def create_user(self, user: str, name: str) -> User:
+    def columns(self) -> tuple:
         """
-        Tries to create an user from given type and user name.
+        Shows whole catalog as columns.
         """
-        if user == "student":
-            return Student(name)
-        if user == "teacher":
-            return Teacher(name)
-        if user == "librarian":
-            return Librarian(name)
-        raise TypeError("Unknown user kind inserted.")
+        rows = self.rows(0, len(self))
+        return (
+            [book.name for book, _, _ in rows],
+            array("q", [book.identify for book, _, _ in rows]),
+            array("i", [book.year for book, _, _ in rows]),
+            array("i", [available for _, available, _ in rows]),
+            array("i", [total for _, _, total in rows]),
+        )
 
-    def check_user_type(self, user: str) -> bool:
+    def load(self, names: list, ids, years, available, total):
         """
-        Checks whether given user type is valid.
+        Fills storage from columns.
         """
-        if user in self.types:
-            return True
-        return False
+        for row in zip(names, ids, years, available, total):
+            book = Book(row[0], row[1], row[2])
+            self.insert(book, row[4])
+            self.add(book, row[3] - row[4], 0)
 
 
-# Facade
-class ActionInterface:
+class CatalogView(Mapping):
     """
-    Class implementing Facade design pattern to show available commands as simple 'interface'.
+    Class representing read-only dictionary of books and their [available, total] counts over
+    any CatalogStore.
 
     Constructor parameters:
-     - catalog (LibraryCatalog): Catalog that does every method presented by interface.
-     - manager (ObserverManager): Manager for Observers awaiting for books.
+     - store (CatalogStore): Viewed storage.
+    """
+
+    def __init__(self, store: CatalogStore):
+        self.store = store
+
+    def __getitem__(self, book: Book) -> list:
+        return list(self.store.counts(book))
+
+    def __iter__(self):
+        for position in range(len(self.store)):
+            yield self.store.book_at(position)
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __contains__(self, book) -> bool:
+        return isinstance(book, Book) and book in self.store
+
+
+class DictStore(CatalogStore):
+    """
+    Class representing default storage keeping books in dictionary.
 
     Parameters:
-     - catalog (LibraryCatalog): Catalog that does every method presented by interface.
-     - manager (ObserverManager): Manager for Observers awaiting for books.
+     - catalog (dict(Book: list(int, int))): Dictionary with books, their available count and
+    total count.
+     - index (dict(int: Book)): Primary index from book ID to the first book with that ID.
+     - order (list(Book)): Books in order of adding.
+    """
+
+    def __init__(self):
+        self.catalog = {}
+        self.index = {}
+        self.order = []
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def __contains__(self, book: Book) -> bool:
+        return book in self.catalog
+
+    def find(self, identify: int) -> Book:
+        return self.index.get(identify)
+
+    def counts(self, book: Book) -> tuple:
+        available, total = self.catalog[book]
+        return available, total
+
+    def insert(self, book: Book, count: int):
+        self.catalog[book] = [count, count]
+        self.order.append(book)
+        # Books sharing an ID are resolved to the first one added
+        self.index.setdefault(book.identify, book)
+
+    def add(self, book: Book, available: int, total: int) -> int:
+        counts = self.catalog[book]
+        counts[0] += available
+        counts[1] += total
+        return counts[0]
+
+    def book_at(self, position: int) -> Book:
+        return self.order[position]
+
+    def rows(self, start: int, stop: int) -> list:
+        return [(book, *self.catalog[book]) for book in self.order[start:stop]]
+
+    def view(self) -> dict:
+        return self.catalog
+
+    def columns(self) -> tuple:
+        return (
+            [book.name for book in self.order],
+            array("q", [book.identify for book in self.order]),
+            array("i", [book.year for book in self.order]),
+            array("i", [counts[0] for counts in self.catalog.values()]),
+            array("i", [counts[1] for counts in self.catalog.values()]),
+        )
+
+    def load(self, names: list, ids, years, available, total):
+        self.order = list(map(Book, names, ids, years))
+        self.catalog = dict(zip(self.order, map(list, zip(available, total))))
+        # The first book with given ID is assigned last, so it wins
+        self.index = dict(zip(reversed(ids), reversed(self.order)))
+
+
+class ColumnStore(CatalogStore):
+    """
+    Class representing compact storage keeping books in columns of arrays instead of separate
+    objects. It takes several times less memory per title than DictStore. Books are rebuilt from
+    columns when asked for, and names are interned, so repeated names are stored once.
+
+    Parameters:
+     - names (list(str)): Book names.
+     - ids (array(int)): Book IDs.
+     - years (array(int)): Book publication years.
+     - available (array(int)): Available counts.
+     - total (array(int)): Total counts.
+     - table (array(int)): Open addressing hash table from book ID to position + 1, 0 marks empty
+    slot. It is kept at most half full.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.ids = array("q")
+        self.years = array("i")
+        self.available = array("i")
+        self.total = array("i")
+        self.table = array("I", bytes(4 * 8))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, book: Book) -> bool:
+        return self.position(book) is not None
+
+    def slot(self, identify: int, size: int) -> int:
+        """
+        Returns first slot for given ID in hash table of given size.
+        """
+        # Fibonacci hashing spreads sequential and strided IDs over the whole table
+        bits = size.bit_length() - 1
+        return ((hash(identify) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> (
+            64 - bits
+        )
+
+    def positions(self, identify: int):
+        """
+        Yields positions of books with given ID in order of adding.
+        """
+        # Rehash may swap the table meanwhile, the old one stays valid for old books
+        table = self.table
+        mask = len(table) - 1
+        slot = self.slot(identify, len(table))
+        while table[slot]:
+            if self.ids[table[slot] - 1] == identify:
+                yield table[slot] - 1
+            slot = (slot + 1) & mask
+
+    def position(self, book: Book) -> int:
+        """
+        Returns position of given book or None.
+        """
+        for position in self.positions(book.identify):
+            if self.names[position] == book.name and self.years[position] == book.year:
+                return position
+        return None
+
+    def find(self, identify: int) -> Book:
+        for position in self.positions(identify):
+            return self.book_at(position)
+        return None
+
+    def counts(self, book: Book) -> tuple:
+        position = self.position(book)
+        if position is None:
+            raise KeyError(book)
+        return self.available[position], self.total[position]
+
+    def insert(self, book: Book, count: int):
+        # Values are converted first, so a bad one fails before any column grows
+        name = sys.intern(book.name)
+        identify = array(self.ids.typecode, [book.identify])
+        numbers = array(self.years.typecode, [book.year, count])
+        self.names.append(name)
+        self.years.append(numbers[0])
+        self.available.append(numbers[1])
+        self.total.append(numbers[1])
+        # IDs go last, as their length is the number of complete books
+        self.ids.extend(identify)
+        if 2 * len(self.ids) > len(self.table):
+            self.rehash(2 * len(self.table))
+        else:
+            self.place(self.table, len(self.ids) - 1)
+
+    def place(self, table, position: int):
+        """
+        Puts book position into given hash table.
+        """
+        mask = len(table) - 1
+        slot = self.slot(self.ids[position], len(table))
+        while table[slot]:
+            slot = (slot + 1) & mask
+        table[slot] = position + 1
+
+    def rehash(self, size: int):
+        """
+        Rebuilds hash table with given number of slots.
+        """
+        table = array("I", bytes(4 * size))
+        # Positions are placed in order of adding, so positions() keeps that order
+        for position in range(len(self.ids)):
+            self.place(table, position)
+        # Swap only complete table, so concurrent readers never probe a partial one
+        self.table = table
+
+    def add(self, book: Book, available: int, total: int) -> int:
+        position = self.position(book)
+        if position is None:
+            raise KeyError(book)
+        self.available[position] += available
+        self.total[position] += total
+        return self.available[position]
+
+    def book_at(self, position: int) -> Book:
+        return Book(self.names[position], self.ids[position], self.years[position])
+
+    def rows(self, start: int, stop: int) -> list:
+        return [
+            (self.book_at(position), self.available[position], self.total[position])
+            for position in range(start, min(stop, len(self.ids)))
+        ]
+
+    def columns(self) -> tuple:
+        return self.names, self.ids, self.years, self.available, self.total
+
+    def load(self, names: list, ids, years, available, total, table=None):
+        """
+        Fills storage from columns, reusing saved hash table if given.
+        """
+        self.names = list(map(sys.intern, names))
+        self.ids = ids
+        self.years = years
+        self.available = available
+        self.total = total
+        if table:
+            self.table = table
+            return
+        size = 8
+        while size < 2 * len(ids):
+            size *= 2
+        self.rehash(size)
+
+
+class SqliteStore(CatalogStore):
+    """
+    Class representing storage keeping books in sqlite3 database, so catalog may be bigger than
+    memory and survives restart when kept in file.
+
+    Constructor parameters:
+     - path (str): Database file, ":memory:" by default. Books already saved there are kept.
+     - cache_size (int): Size of database page cache in KiB, 16384 by default.
+
+    Parameters:
+     - path (str): Database file.
+     - connection (Connection): Connection to database, shared by all threads.
+     - size (int): Number of stored titles.
+     - lock (Lock): Lock guarding connection.
+
+    Methods:
+     - close(): Closes database.
+
+    Books are stored in table with positions as primary key, with index on ID and unique index
+    on ID, name and year, so every lookup is an indexed search. Every statement text is fixed,
+    so sqlite3 reuses its prepared statements from cache. Changing counts is one transaction
+    committed at once, so a crash cannot leave half-done borrowing or returning, while
+    LibraryCatalog locks make checking and changing counts of a title atomic. Files use
+    write-ahead log, so commits are cheap.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS books (position INTEGER PRIMARY KEY, name TEXT NOT NULL,"
+        " id INTEGER NOT NULL, year INTEGER NOT NULL, available INTEGER NOT NULL,"
+        " total INTEGER NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS books_id ON books (id, position)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS books_key ON books (id, name, year)",
+    )
+    FIND = "SELECT name, id, year FROM books WHERE id = ? ORDER BY position LIMIT 1"
+    COUNTS = "SELECT available, total FROM books WHERE id = ? AND name = ? AND year = ?"
+    INSERT = "INSERT INTO books VALUES (?, ?, ?, ?, ?, ?)"
+    ADD = (
+        "UPDATE books SET available = available + ?, total = total + ?"
+        " WHERE id = ? AND name = ? AND year = ?"
+    )
+    AT = "SELECT name, id, year FROM books WHERE position = ?"
+    ROWS = (
+        "SELECT name, id, year, available, total FROM books"
+        " WHERE position >= ? AND position < ? ORDER BY position"
+    )
+
+    def __init__(self, path: str = ":memory:", cache_size: int = 16384):
+        self.path = path
+        self.connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self.connection.execute(f"PRAGMA cache_size = -{int(cache_size)}")
+        if path != ":memory:":
+            self.connection.execute("PRAGMA journal_mode = WAL")
+            self.connection.execute("PRAGMA synchronous = NORMAL")
+        for statement in self.SCHEMA:
+            self.connection.execute(statement)
+        self.size = self.connection.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, book: Book) -> bool:
+        with self.lock:
+            row = self.connection.execute(
+                self.COUNTS, (book.identify, book.name, book.year)
+            ).fetchone()
+        return row is not None
+
+    def find(self, identify: int) -> Book:
+        with self.lock:
+            row = self.connection.execute(self.FIND, (identify,)).fetchone()
+        return None if row is None else Book(*row)
+
+    def counts(self, book: Book) -> tuple:
+        with self.lock:
+            row = self.connection.execute(
+                self.COUNTS, (book.identify, book.name, book.year)
+            ).fetchone()
+        if row is None:
+            raise KeyError(book)
+        return row
+
+    def insert(self, book: Book, count: int):
+        with self.lock:
+            self.connection.execute(
+                self.INSERT,
+                (self.size, book.name, book.identify, book.year, count, count),
+            )
+            self.size += 1
+
+    def add(self, book: Book, available: int, total: int) -> int:
+        key = (book.identify, book.name, book.year)
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.execute(self.ADD, (available, total) + key)
+                row = self.connection.execute(self.COUNTS, key).fetchone()
+                if row is None:
+                    raise KeyError(book)
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+        return row[0]
+
+    def book_at(self, position: int) -> Book:
+        with self.lock:
+            row = self.connection.execute(self.AT, (position,)).fetchone()
+        if row is None:
+            raise IndexError(position)
+        return Book(*row)
+
+    def rows(self, start: int, stop: int) -> list:
+        with self.lock:
+            rows = self.connection.execute(self.ROWS, (start, stop)).fetchall()
+        return [(Book(*row[:3]), row[3], row[4]) for row in rows]
+
+    def load(self, names: list, ids, years, available, total):
+        """
+        Replaces stored books with columns in one transaction.
+        """
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                self.connection.execute("DELETE FROM books")
+                self.connection.executemany(
+                    self.INSERT,
+                    zip(
+                        range(len(names)),
+                        names,
+                        ids,
+                        years,
+                        available,
+                        total,
+                    ),
+                )
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+            self.size = len(names)
+
+    def close(self):
+        """
+        Closes database.
+        """
+        with self.lock:
+            self.connection.close()
+
+
+# Search
+class SearchIndex:
+    """
+    Class indexing titles and years of books in storage, see LibraryCatalog.search().
+
+    Constructor parameters:
+     - store (CatalogStore): Indexed storage.
+
+    Parameters:
+     - store (CatalogStore): Indexed storage.
+     - size (int): Number of indexed titles, titles are indexed in order of storage.
+     - postings (dict(str: array)): Positions of titles containing each word, ascending.
+     - vocabulary (list(str)): All words in alphabetical order, used for prefix search.
+     - years (dict(int: array)): Positions of titles published in each year, ascending.
+     - calendar (list(int)): All years in ascending order.
+     - lock (Lock): Lock guarding index.
+
+    Methods:
+     - words(text: str) -> list(str): Splits text into lowercase words.
+     - extend(): Indexes titles added to storage since last call.
+     - title(text: str) -> set(int): Returns positions of titles containing all words of text.
+     - prefix(text: str) -> set(int): Returns positions of titles containing a word starting
+    with text.
+     - between(start: int, stop: int) -> set(int): Returns positions of titles published from
+    start to stop year, both included. Missing year means no limit.
+
+    Words are kept in inverted index, so finding a word costs one dictionary lookup no matter
+    how big catalog is. Vocabulary stays sorted: a few new words are inserted in place, while
+    many new words (like the first indexing of big catalog) are merged in with one sort, so
+    neither adding books nor prefix search sorts the whole vocabulary over and over.
+    """
+
+    def __init__(self, store: CatalogStore):
+        self.store = store
+        self.size = 0
+        self.postings: dict[str, array] = {}
+        self.vocabulary: list[str] = []
+        self.years: dict[int, array] = {}
+        self.calendar: list[int] = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def words(text: str) -> list:
+        """
+        Splits text into words.
+        """
+        return re.findall(r"\w+", text.lower())
+
+    def extend(self):
+        """
+        Indexes new titles.
+        """
+        with self.lock:
+            stop = len(self.store)
+            new = []
+            for position in range(self.size, stop):
+                book = self.store.book_at(position)
+                for word in set(self.words(book.name)):
+                    if word not in self.postings:
+                        self.postings[word] = array("I")
+                        new.append(word)
+                    self.postings[word].append(position)
+                if book.year not in self.years:
+                    self.years[book.year] = array("I")
+                    bisect.insort(self.calendar, book.year)
+                self.years[book.year].append(position)
+            # Each insertion shifts the list, so for many words one sort is cheaper
+            if len(new) * 16 < len(self.vocabulary):
+                for word in new:
+                    bisect.insort(self.vocabulary, word)
+            elif new:
+                self.vocabulary.extend(new)
+                self.vocabulary.sort()
+            self.size = stop
+
+    def title(self, text: str) -> set:
+        """
+        Finds titles containing all given words.
+        """
+        with self.lock:
+            # Start from the rarest word, so the set stays small
+            found = sorted(
+                (self.postings.get(i, ()) for i in set(self.words(text))), key=len
+            )
+            if not found:
+                return set()
+            positions = set(found[0])
+            for i in found[1:]:
+                positions.intersection_update(i)
+            return positions
+
+    def prefix(self, text: str) -> set:
+        """
+        Finds titles containing word with given beginning.
+        """
+        text = text.lower()
+        with self.lock:
+            positions = set()
+            for i in range(
+                bisect.bisect_left(self.vocabulary, text), len(self.vocabulary)
+            ):
+                if not self.vocabulary[i].startswith(text):
+                    break
+                positions.update(self.postings[self.vocabulary[i]])
+            return positions
+
+    def between(self, start: int = None, stop: int = None) -> set:
+        """
+        Finds titles published in given years.
+        """
+        with self.lock:
+            positions = set()
+            first = 0 if start is None else bisect.bisect_left(self.calendar, start)
+            last = (
+                len(self.calendar)
+                if stop is None
+                else bisect.bisect_right(self.calendar, stop)
+            )
+            for i in range(first, last):
+                positions.update(self.years[self.calendar[i]])
+            return positions
+
+
+# Snapshot file starts with magic, byte order flag, number of titles, number of hash
+# table slots and sizes of names and metadata blobs
+SNAPSHOT_MAGIC = b"DPSNAP01"
+SNAPSHOT_HEADER = struct.Struct("<8s?7xQQQQ")
+
+
+# Singleton + Iterator
+class LibraryCatalog:
+    """
+    Class representing book catalog in library.
+    It uses Singleton pattern design (one catalog is enough)
+    and Iterator (to show next books in catalog).
+
+    Constructor parameters:
+    None
+
+    Parameters:
+     - instance (LibraryCatalog): Singleton instance.
+     - store (CatalogStore): Storage of books, DictStore by default.
+     - catalog (dict(Book: list(int, int))): Dictionary with books in catalog, their available
+    count and total count. For other storages than DictStore it is a read-only view.
+     - current (int): Index used for Iterator design pattern in get_next() method.
+     - journal (Journal): Journal recording changes of catalog and loans, None by default.
+     - generation (int): Generation of journal whose records are already included in catalog, see
+    Journal.
+     - lock (Lock): Lock guarding creation of instance.
+     - user_locks (LockStripes): Locks of users' book lists.
+     - title_locks (LockStripes): Locks of book counts, by book ID.
+     - insert_lock (Lock): Lock guarding adding new titles to storage.
+     - index (SearchIndex): Index of titles and years, None until first search.
+
+    Methods:
+     - use_store(store: CatalogStore): Replaces storage of catalog, for example with ColumnStore
+    to keep big catalog in compact form. Meant to be called before adding books.
+     - find(identify: int) -> Book: Returns book with given ID or None.
+     - get_catalog() -> dict: Returns full catalog.
+     - get_next() -> str: Returns next book in catalog.
+     - describe(book: Book) -> str: Returns book with its available and total count.
+     - page(cursor: str, size: int) -> tuple(list(tuple(Book, int, int)), str): Returns up to
+    size books starting at cursor (None means the beginning) with their available and total
+    counts, and a continuation token for the next call. Books added meanwhile are picked up by
+    later calls, nothing is skipped or repeated. Raises ValueError for a malformed cursor or size
+    smaller than 1.
+     - add_book(book: Book) -> int: Adds book to catalog. Increases count and returns 1 if book
+    already exists, otherwise returns 2.
+     - add_copies(book: Book, count: int) -> int: Adds count copies of book to catalog. Returns 1
+    if book already exists, otherwise returns 2.
+     - add_books(books: iterable(Book)) -> dict(int: int): Adds many books at once. Copies of the
+    same book are grouped first and every group is merged into catalog once. Returns how many
+    books ended as new titles (key 2) and how many as copies of existing ones (key 1), the same
+    as calling add_book() for each book would.
+     - add_counts(pairs: iterable(tuple(Book, int))) -> dict(int: int): Same as add_books(), but
+    every book comes with its number of copies, so many copies do not need a repeated book each.
+     - search(title: str, prefix: str, start: int, stop: int, limit: int) -> list(Book): Returns
+    up to limit books, in order of adding, whose title contains all words of title, a word
+    starting with prefix and whose year is between start and stop (both included). Conditions
+    left as None are not checked. Builds SearchIndex on first call, later it is updated by
+    add_book().
+     - borrow_book(user: User, identify: int, manager: ObserverManager) -> int: Tries to find a
+    book by its ID and declare one of copies as ordered by user. Decreases book count and returns
+    1 if user has not reached book limit and book is available, 0 if book is unavailable right
+    now, -1 if user reached book limit, -2 if user already ordered this book or -3 if book does
+    not exist. Informs ObserverManager to notify users. A copy held for user is ordered without
+    changing book count; if user reached book limit, the copy goes to the next waiter instead.
+     - return_book(user: User, identify: int, manager: ObserverManager) -> int: Tries to find a
+    book by its ID and return it to library. Increases book count, removes it from user's list and
+    returns 1 if the book exists and user has it, -1 if user has no book borrowed, -2 if user has
+    not borrowed this book or -3 if the book does not exist. Informs ObserverManager to notify
+    users, or to hold the copy for the first waiter if it keeps reservations.
+     - reserve(book: Book, manager: ObserverManager): Asks manager to hold a returned copy of book
+    and takes it out of available copies if somebody waits for it.
+     - release(user: User, identify: int, manager: ObserverManager) -> int: Gives up copy of book
+    held for user, passing it to the next waiter or back to available copies. Returns 1 if the
+    copy was held, -2 if no copy is held for user or -3 if book does not exist.
+     - decline(user: User, identify: int, manager: ObserverManager) -> int: Same as release(), for
+    callers already holding locks of user and book.
+     - update_borrow(user: User, identify: int) -> int: Tries to update book's status in user's
+    list from "Ordered" to "Borrowed". Changes status and returns 1 if user has this book and it
+    is "Ordered", -1 if the book is not "Ordered" or -2 if user does not have this book in its
+    list.
+     - borrow_many(operations: iterable(tuple(User, int)), manager: ObserverManager) ->
+    list(int): Borrows many books, returning codes of borrow_book() in order of operations. Books
+    of one user are borrowed in given order with its lock taken once.
+     - return_many(operations: iterable(tuple(User, int)), manager: ObserverManager) ->
+    list(int): Returns many books, returning codes of return_book() in order of operations.
+    Observers of every title that became available are notified once, after all books are back.
+     - group(operations: iterable(tuple(User, int))) -> dict(str: tuple(User, list(tuple(int,
+    int)))): Groups positions and book IDs of operations by user's name.
+     - save_snapshot(path: str, users: list(User), manager: ObserverManager): Saves catalog,
+    loans of given users and waitlists and holds of manager to binary file. Book columns are
+    written as raw arrays (and the ID hash table of ColumnStore as well), so loading them back is
+    a few memory copies. Only ColumnStore loads a million titles well under a second (about
+    0.6 s), DictStore needs a few seconds to build a Book for every title (see snapshot_load in
+    benchmark.py). Raises ValueError if a book name contains NUL character.
+     - load_snapshot(path: str, manager: ObserverManager) -> list(User): Replaces catalog with
+    the one saved in file, keeping the current storage type (SqliteStore is refilled in place,
+    keeping its database file), and restores saved waitlists (in order of waiting for every book)
+    and holds into given (empty) manager. Returns saved users with their loans. Raises
+    ValueError if the file is not a snapshot.
+
+    Changes made by add_book(), borrow_book(), return_book() and update_borrow() are recorded in
+    journal, if there is one.
+
+    Adding, borrowing and returning books is safe to call from many threads. Every operation
+    locks only its user and title (locks of users are always taken first), so operations on
+    different titles do not wait for each other. use_store() and snapshot loading are meant to be
+    called before serving requests.
+
+    Notes:
+     * Why Singleton? Library needs only one catalog for books. Creating second one may make a
+    mess with searching in two catalog and this would be troublesome.
+     * Why Iterator? Catalog may become very big in time and looking at dictionary of all books
+    can be confusing. By showing one book lineally, user can look at different book every time if
+    catalog is big enough.
+    """
+
+    lock = threading.Lock()
+
+    def __new__(cls):
+        if not hasattr(cls, "instance"):
+            with cls.lock:
+                # Another thread may have created instance while this one was waiting
+                if not hasattr(cls, "instance"):
+                    instance = super(LibraryCatalog, cls).__new__(cls)
+                    instance.use_store(DictStore())
+                    instance.journal = None
+                    instance.generation = 0
+                    instance.user_locks = LockStripes()
+                    instance.title_locks = LockStripes()
+                    instance.insert_lock = threading.Lock()
+                    cls.instance = instance
+        return cls.instance
+
+    def use_store(self, store: CatalogStore):
+        """
+        Replaces storage of catalog.
+        """
+        self.store = store
+        self.current = 0
+        self.index = None
+
+    @property
+    def catalog(self) -> dict:
+        """
+        Shows whole catalog.
+        """
+        return self.store.view()
+
+    def find(self, identify: int) -> Book:
+        """
+        Finds book by its ID.
+        """
+        return self.store.find(identify)
+
+    def get_catalog(self) -> dict:
+        """
+        Shows whole catalog.
+        """
+        return self.catalog
+
+    # Iterator
+    def __iter__(self):
+        position = 0
+        # Re-check length on every step, so books added while iterating are visited too
+        while position < len(self.store):
+            yield self.store.book_at(position)
+            position += 1
+
+    def get_next(self) -> str:
+        """
+        Shows one book from catalog.
+        """
+        if len(self.store) < 1:
+            return "No books in catalog."
+        if self.current == len(self.store):
+            self.current = 0
+        self.current += 1
+        return self.describe(self.store.book_at(self.current - 1))
+
+    def describe(self, book: Book) -> str:
+        """
+        Shows book with its counts.
+        """
+        available, total = self.store.counts(book)
+        return f"{book}, count: {available}/{total}"
+
+    def page(self, cursor: str = None, size: int = 10) -> tuple:
+        """
+        Shows part of catalog starting at given cursor.
+        """
+        if size < 1:
+            raise ValueError("Page size must be positive.")
+        start = 0 if cursor is None else int(cursor, 16)
+        if start < 0 or start > len(self.store):
+            raise ValueError("Unknown catalog cursor.")
+        batch = self.store.rows(start, start + size)
+        return batch, format(start + len(batch), "x")
+
+    def add_book(self, book: Book) -> int:
+        """
+        Adds given book to catalog.
+        """
+        return self.add_copies(book, 1)
+
+    def add_copies(self, book: Book, count: int) -> int:
+        """
+        Adds given number of book copies to catalog.
+        """
+        with self.title_locks.get(book.identify):
+            if book in self.store:
+                self.store.add(book, count, count)
+                code = 1
+            else:
+                with self.insert_lock:
+                    self.store.insert(book, count)
+                    if self.index is not None:
+                        self.index.extend()
+                code = 2
+            # Recorded only once store accepted book, so replay never meets rejected values
+            if self.journal is not None:
+                self.journal.record("A", None, book, count)
+            return code
+
+    def search(
+        self,
+        title: str = None,
+        prefix: str = None,
+        start: int = None,
+        stop: int = None,
+        limit: int = None,
+    ) -> list:
+        """
+        Finds books matching all given conditions.
+        """
+        if self.index is None:
+            with self.insert_lock:
+                if self.index is None:
+                    index = SearchIndex(self.store)
+                    index.extend()
+                    self.index = index
+        # Books added to storage directly (snapshots, replay) are indexed now
+        self.index.extend()
+        found = []
+        if title is not None:
+            found.append(self.index.title(title))
+        if prefix is not None:
+            found.append(self.index.prefix(prefix))
+        if start is not None or stop is not None:
+            found.append(self.index.between(start, stop))
+        if not found:
+            positions = range(len(self.store))
+        else:
+            found.sort(key=len)
+            positions = sorted(found[0].intersection(*found[1:]))
+        return [self.store.book_at(i) for i in positions[:limit]]
+
+    def add_books(self, books) -> dict:
+        """
+        Adds many books to catalog.
+        """
+        return self.add_counts((book, 1) for book in books)
+
+    def add_counts(self, pairs) -> dict:
+        """
+        Adds many books with their numbers of copies to catalog.
+        """
+        groups = {}
+        for book, count in pairs:
+            key = (book.name, book.identify, book.year)
+            if key in groups:
+                groups[key][1] += count
+            else:
+                groups[key] = [book, count]
+        outcome = {1: 0, 2: 0}
+        for book, count in groups.values():
+            if self.add_copies(book, count) == 2:
+                # First copy created the title, the rest are copies
+                outcome[2] += 1
+                count -= 1
+            outcome[1] += count
+        return outcome
+
+    def borrow_book(self, user: User, identify: int, manager: ObserverManager) -> int:
+        """
+        Tries to borrow book to user.
+        """
+        with self.user_locks.get(user.name), self.title_locks.get(identify):
+            if user.limit <= len(user.books):
+                # Max book limit reached, copy held for user goes to the next waiter
+                if manager.reservations:
+                    self.decline(user, identify, manager)
+                return -1
+            i = self.store.find(identify)
+            if i is None:
+                # This book is not in catalog
+                return -3
+            if user.loan(identify) is not None:
+                # User already has this book
+                return -2
+            if manager.reservations and manager.claim(user, i):
+                # Copy was held for this user, so it is not counted as available
+                user.set_loan(i, "Ordered")
+                if self.journal is not None:
+                    self.journal.record("C", user, i)
+                return 1
+            if self.store.counts(i)[0] < 1:
+                # Book unavailable right now, add user to observers
+                manager.attach(user, i)
+                return 0
+            # Give book to user's list as ordered (not taken yet)
+            user.set_loan(i, "Ordered")
+            self.store.add(i, -1, 0)
+            if self.journal is not None:
+                self.journal.record("O", user, i)
+            manager.deattach(user, i)
+            return 1
+
+    def return_book(self, user: User, identify: int, manager: ObserverManager) -> int:
+        """
+        Returns book to catalog.
+        """
+        with self.user_locks.get(user.name), self.title_locks.get(identify):
+            if len(user.books) < 1:
+                # What does user want to return?
+                return -1
+            i = self.store.find(identify)
+            if i is None:
+                # This book is not in catalog
+                return -3
+            j = user.loan(identify)
+            if j is None:
+                # User did not borrow this book
+                return -2
+            # Everything is in order
+            user.remove_loan(j)
+            available = self.store.add(i, 1, 0)
+            if self.journal is not None:
+                self.journal.record("R", user, i)
+            if manager.reservations:
+                # Copy goes to the first waiter only
+                self.reserve(i, manager)
+            elif available == 1:
+                # Book is available, inform observers
+                manager.notify(i)
+            return 1
+
+    def reserve(self, book: Book, manager: ObserverManager):
+        """
+        Holds returned copy of book for its first waiter.
+        """
+        if manager.hold(book) is not None:
+            self.store.add(book, -1, 0)
+
+    def release(self, user: User, identify: int, manager: ObserverManager) -> int:
+        """
+        Gives up copy held for user.
+        """
+        with self.user_locks.get(user.name), self.title_locks.get(identify):
+            return self.decline(user, identify, manager)
+
+    def decline(self, user: User, identify: int, manager: ObserverManager) -> int:
+        """
+        Gives up copy held for user, with locks already taken.
+        """
+        i = self.store.find(identify)
+        if i is None:
+            # This book is not in catalog
+            return -3
+        if not manager.claim(user, i):
+            # No copy is held for user
+            return -2
+        self.store.add(i, 1, 0)
+        if self.journal is not None:
+            self.journal.record("D", user, i)
+        self.reserve(i, manager)
+        return 1
+
+    def update_borrow(self, user: User, identify: int) -> int:
+        """
+        Changes book's status.
+        """
+        with self.user_locks.get(user.name):
+            i = user.loan(identify)
+            if i is None:
+                # User does not have this book in list
+                return -2
+            if user.books[i] != "Ordered":
+                # Book is not ordered (it is probably taken already)
+                return -1
+            # User took the book
+            user.set_loan(i, "Borrowed")
+            if self.journal is not None:
+                self.journal.record("B", user, i)
+            return 1
+
+    @staticmethod
+    def group(operations) -> dict:
+        """
+        Groups positions and book IDs of operations by user.
+        """
+        groups = {}
+        for position, (user, identify) in enumerate(operations):
+            if user.name in groups:
+                groups[user.name][1].append((position, identify))
+            else:
+                groups[user.name] = (user, [(position, identify)])
+        return groups
+
+    def borrow_many(self, operations, manager: ObserverManager) -> list:
+        """
+        Tries to borrow many books.
+        """
+        groups = self.group(operations)
+        codes = [0] * sum(len(i[1]) for i in groups.values())
+        for user, items in groups.values():
+            with self.user_locks.get(user.name):
+                for position, identify in items:
+                    if user.limit <= len(user.books):
+                        if manager.reservations:
+                            with self.title_locks.get(identify):
+                                self.decline(user, identify, manager)
+                        codes[position] = -1
+                        continue
+                    with self.title_locks.get(identify):
+                        i = self.store.find(identify)
+                        if i is None:
+                            codes[position] = -3
+                        elif user.loan(identify) is not None:
+                            codes[position] = -2
+                        elif manager.reservations and manager.claim(user, i):
+                            user.set_loan(i, "Ordered")
+                            if self.journal is not None:
+                                self.journal.record("C", user, i)
+                            codes[position] = 1
+                        elif self.store.counts(i)[0] < 1:
+                            manager.attach(user, i)
+                            codes[position] = 0
+                        else:
+                            user.set_loan(i, "Ordered")
+                            self.store.add(i, -1, 0)
+                            if self.journal is not None:
+                                self.journal.record("O", user, i)
+                            manager.deattach(user, i)
+                            codes[position] = 1
+        return codes
+
+    def return_many(self, operations, manager: ObserverManager) -> list:
+        """
+        Returns many books to catalog.
+        """
+        groups = self.group(operations)
+        codes = [0] * sum(len(i[1]) for i in groups.values())
+        freed = {}
+        for user, items in groups.values():
+            with self.user_locks.get(user.name):
+                for position, identify in items:
+                    if len(user.books) < 1:
+                        codes[position] = -1
+                        continue
+                    with self.title_locks.get(identify):
+                        i = self.store.find(identify)
+                        if i is None:
+                            codes[position] = -3
+                        elif user.loan(identify) is None:
+                            codes[position] = -2
+                        else:
+                            user.remove_loan(user.loan(identify))
+                            available = self.store.add(i, 1, 0)
+                            if self.journal is not None:
+                                self.journal.record("R", user, i)
+                            if manager.reservations:
+                                self.reserve(i, manager)
+                            elif available == 1:
+                                freed[identify] = i
+                            codes[position] = 1
+        # One notification per title, even if several copies came back
+        for i in freed.values():
+            manager.notify(i)
+        return codes
+
+    def save_snapshot(
+        self, path: str, users: list = (), manager: ObserverManager = None
+    ):
+        """
+        Saves catalog, loans and waitlists to file.
+        """
+        names, ids, years, available, total = self.store.columns()
+        blob = "\0".join(names).encode("utf-8")
+        if blob.count(b"\0") != max(len(names) - 1, 0):
+            raise ValueError("Book names with NUL character cannot be saved.")
+        table = self.store.table if isinstance(self.store, ColumnStore) else array("I")
+        people = {user.name: user for user in users}
+        observers = manager.observers if manager is not None else []
+        for i in observers:
+            people.setdefault(i.user.name, i.user)
+        numbers = {name: number for number, name in enumerate(people)}
+        meta = {
+            "generation": self.generation,
+            "users": [
+                [
+                    type(user).__name__.lower(),
+                    user.name,
+                    [[i.name, i.identify, i.year, j] for i, j in user.books.items()],
+                ]
+                for user in people.values()
+            ],
+            "waitlists": [
+                [numbers[i.user.name], [[j.name, j.identify, j.year] for j in i.books]]
+                for i in observers
+            ],
+            # Order of waiting for every book, which waitlists of observers lose
+            "queues": [
+                [identify, [numbers[name] for name in waiting]]
+                for identify, waiting in (
+                    manager.waiters.items() if manager is not None else []
+                )
+            ],
+            "holds": [
+                [numbers[name], [i.name, i.identify, i.year]]
+                for held in (manager.holds.values() if manager is not None else [])
+                for name, i in held.items()
+            ],
+        }
+        meta_blob = json.dumps(meta, separators=(",", ":")).encode("utf-8")
+        with open(path, "wb") as f:
+            f.write(
+                SNAPSHOT_HEADER.pack(
+                    SNAPSHOT_MAGIC,
+                    sys.byteorder == "little",
+                    len(names),
+                    len(table),
+                    len(blob),
+                    len(meta_blob),
+                )
+            )
+            for column in (ids, years, available, total, table):
+                column.tofile(f)
+            f.write(blob)
+            f.write(meta_blob)
+
+    def load_snapshot(self, path: str, manager: ObserverManager = None) -> list:
+        """
+        Loads catalog, loans and waitlists from file.
+        """
+        with open(path, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data, memoryview(data) as view:
+            if len(view) < SNAPSHOT_HEADER.size:
+                raise ValueError("File is not a catalog snapshot.")
+            magic, little, titles, slots, size, meta_size = SNAPSHOT_HEADER.unpack(
+                view[: SNAPSHOT_HEADER.size]
+            )
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError("File is not a catalog snapshot.")
+            offset = SNAPSHOT_HEADER.size
+            columns = []
+            for typecode, length in (
+                ("q", titles),
+                ("i", titles),
+                ("i", titles),
+                ("i", titles),
+                ("I", slots),
+            ):
+                column = array(typecode)
+                column.frombytes(view[offset : offset + column.itemsize * length])
+                if little != (sys.byteorder == "little"):
+                    column.byteswap()
+                columns.append(column)
+                offset += column.itemsize * length
+            names = bytes(view[offset : offset + size]).decode("utf-8").split("\0")
+            offset += size
+            meta = json.loads(bytes(view[offset : offset + meta_size]))
+        store = self.store
+        if not isinstance(store, SqliteStore):
+            # Database keeps its file and connection, other stores are rebuilt from scratch
+            store = type(self.store)()
+        if isinstance(store, ColumnStore):
+            store.load(names if titles else [], *columns)
+        else:
+            store.load(names if titles else [], *columns[:4])
+        self.use_store(store)
+        self.generation = meta.get("generation", 0)
+        factory = UserFactory()
+        users = []
+        for kind, name, loans in meta["users"]:
+            user = factory.create_user(kind, name)
+            for book_name, identify, year, status in loans:
+                user.set_loan(Book(book_name, identify, year), status)
+            users.append(user)
+        if manager is not None:
+            wanted = {}
+            for number, books in meta["waitlists"]:
+                for book_name, identify, year in books:
+                    wanted[number, identify] = Book(book_name, identify, year)
+            order = list(wanted)
+            if "queues" in meta:
+                order = [(j, i) for i, waiting in meta["queues"] for j in waiting]
+            for number, identify in order:
+                manager.wait(users[number], wanted[number, identify])
+            for number, (book_name, identify, year) in meta.get("holds", []):
+                manager.keep(users[number], Book(book_name, identify, year))
+        return users
+
+
+# Journal
+class Journal:
+    """
+    Class representing append-only journal (write-ahead log) of catalog and waitlist changes.
+    Together with snapshot it allows to recover state after crash.
+
+    Every record is one json line describing change that has already been checked, so replaying
+    it does not need any checks: "A" - copies added, "O" - book ordered, "B" - book borrowed,
+    "R" - book returned, "W" - book wishlisted, "U" - book removed from wishlist, "H" - returned
+    copy held for waiter, "C" - held copy ordered by its user and "D" - held copy given up by its
+    user. Records are synced to disk in groups by a timer thread, never by the thread recording
+    them, so a crash loses only records of about the last sync_interval, or about the last
+    sync_every records during a burst.
+
+    The first line of journal holds its generation. Compacting saves snapshot with the next
+    generation and only then starts a new journal with it, so replay knows to skip records that
+    snapshot already includes, even if crash happened in between.
+
+    Constructor parameters:
+     - path (str): Journal file, created if it does not exist.
+     - sync_every (int): Maximum number of records between syncs.
+     - sync_interval (float): Maximum number of seconds between syncs.
+
+    Parameters:
+     - path (str): Journal file.
+     - sync_every (int): Maximum number of records between syncs.
+     - sync_interval (float): Maximum number of seconds between syncs.
+     - generation (int): Generation of journal.
+     - pending (int): Number of records written since the last sync.
+     - lock (Lock): Lock guarding writes, so records from many threads do not interleave.
+     - timer (Timer): Timer syncing pending records, None if not armed.
+     - users (dict(str: User)): Users recovered or recorded so far by their names, so compaction
+    keeps their loans even if caller does not list them.
+
+    Methods:
+     - record(operation: str, user: User, book: Book, count: int): Appends record.
+     - arm(delay: float): Schedules sync, with lock already taken.
+     - sync(): Writes pending records to disk.
+     - flush() -> int: Writes pending records to operating system, with lock already taken.
+     - close(): Syncs and closes journal.
+     - replay(catalog: LibraryCatalog, manager: ObserverManager, users: list(User)) -> list(User):
+    Applies records to catalog and manager, unless catalog is already at newer generation.
+    Creates users not found in given list and returns all of them. Stops at torn last record.
+     - recover(catalog: LibraryCatalog, manager: ObserverManager, snapshot: str) -> list(User):
+    Loads snapshot if it exists, replays journal and starts recording changes of catalog and
+    manager. If snapshot is newer than journal (compaction was interrupted), a new journal of
+    snapshot's generation is started first. Returns recovered users.
+     - compact(catalog: LibraryCatalog, snapshot: str, users: list(User), manager:
+    ObserverManager): Saves current state to snapshot and empties journal. Snapshot includes
+    given users and every user known to journal. Writers of catalog and manager wait until it
+    is done.
+    """
+
+    def __init__(self, path: str, sync_every: int = 256, sync_interval: float = 0.05):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.generation = 0
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "r", encoding="utf-8") as f:
+                self.generation = json.loads(f.readline())[1]
+            # Journal stays open for appending until close(), so no context manager
+            self.file = open(path, "a", encoding="utf-8")  # noqa: SIM115
+        else:
+            self.file = self.start(self.generation)
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.timer = None
+        self.users = {}
+
+    def start(self, generation: int):
+        """
+        Atomically replaces journal with an empty one of given generation.
+        """
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(json.dumps(["G", generation]) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + ".tmp", self.path)
+        return open(self.path, "a", encoding="utf-8")
+
+    def record(self, operation: str, user: User, book: Book, count: int = 1):
+        """
+        Appends record to journal.
+        """
+        kind = type(user).__name__.lower() if user is not None else None
+        name = user.name if user is not None else None
+        line = json.dumps(
+            [operation, kind, name, book.name, book.identify, book.year, count]
+        )
+        with self.lock:
+            self.file.write(line + "\n")
+            self.pending += 1
+            if user is not None:
+                self.users[user.name] = user
+            # Only timer thread syncs disk, so caller (even event loop) never waits for it
+            if self.pending >= self.sync_every:
+                self.arm(0)
+            elif self.timer is None:
+                self.arm(self.sync_interval)
+
+    def arm(self, delay: float):
+        """
+        Schedules sync after given delay, unless it is already scheduled sooner.
+        """
+        if self.timer is not None:
+            if self.timer.interval <= delay:
+                return
+            self.timer.cancel()
+        self.timer = threading.Timer(delay, self.sync)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def sync(self):
+        """
+        Writes pending records to disk.
+        """
+        with self.lock:
+            # Timer may fire after journal was closed
+            if self.file.closed:
+                return
+            fileno = self.flush()
+        # Records appended meanwhile are not blocked by slow fsync
+        try:
+            os.fsync(fileno)
+        finally:
+            os.close(fileno)
+
+    def flush(self) -> int:
+        """
+        Writes pending records to operating system, with lock already taken. Returns duplicate of
+        file descriptor to be synced and closed by caller, which stays valid even if journal is
+        closed meanwhile.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.file.flush()
+        self.pending = 0
+        return os.dup(self.file.fileno())
+
+    def close(self):
+        """
+        Syncs and closes journal.
+        """
+        self.sync()
+        self.file.close()
+
+    def replay(
+        self,
+        catalog: LibraryCatalog,
+        manager: ObserverManager = None,
+        users: list = (),
+    ) -> list:
+        """
+        Applies journal records.
+        """
+        people = {user.name: user for user in users}
+        if catalog.generation > self.generation:
+            # Snapshot was saved by compaction that did not finish replacing journal
+            return list(people.values())
+        factory = UserFactory()
+        self.file.flush()
+        with open(self.path, "r", encoding="utf-8") as f:
+            f.readline()
+            for line in f:
+                try:
+                    operation, kind, name, title, identify, year, count = json.loads(
+                        line
+                    )
+                except ValueError:
+                    # Torn record written during crash
+                    break
+                book = Book(title, identify, year)
+                if operation == "A":
+                    if book in catalog.store:
+                        catalog.store.add(book, count, count)
+                    else:
+                        catalog.store.insert(book, count)
+                    continue
+                if name not in people:
+                    people[name] = factory.create_user(kind, name)
+                user = people[name]
+                if operation == "O":
+                    user.set_loan(book, "Ordered")
+                    catalog.store.add(book, -1, 0)
+                elif operation == "B":
+                    user.set_loan(book, "Borrowed")
+                elif operation == "R":
+                    user.remove_loan(book)
+                    catalog.store.add(book, 1, 0)
+                elif operation == "W" and manager is not None:
+                    manager.wait(user, book)
+                elif operation == "U" and manager is not None:
+                    manager.unwait(user, book)
+                elif operation == "H":
+                    catalog.store.add(book, -1, 0)
+                    if manager is not None:
+                        manager.keep(user, book)
+                elif operation == "C":
+                    user.set_loan(book, "Ordered")
+                    if manager is not None:
+                        manager.claim(user, book)
+                elif operation == "D":
+                    catalog.store.add(book, 1, 0)
+                    if manager is not None:
+                        manager.claim(user, book)
+        return list(people.values())
+
+    def recover(
+        self, catalog: LibraryCatalog, manager: ObserverManager, snapshot: str
+    ) -> list:
+        """
+        Restores state from snapshot and journal.
+        """
+        users = []
+        if os.path.exists(snapshot):
+            users = catalog.load_snapshot(snapshot, manager)
+        users = self.replay(catalog, manager, users)
+        if catalog.generation > self.generation:
+            # Old journal is in snapshot, new records must not be skipped next time
+            self.file.close()
+            self.generation = catalog.generation
+            self.file = self.start(self.generation)
+        self.users.update((user.name, user) for user in users)
+        catalog.journal = self
+        manager.journal = self
+        return users
+
+    def compact(
+        self,
+        catalog: LibraryCatalog,
+        snapshot: str,
+        users: list = (),
+        manager: ObserverManager = None,
+    ):
+        """
+        Saves state to snapshot and empties journal, while writers wait.
+        """
+        # Locks are taken in the order writers nest them, so no change is half done or lost
+        locks = catalog.user_locks.locks + catalog.title_locks.locks
+        locks.append(catalog.insert_lock)
+        if manager is not None:
+            locks += manager.user_locks.locks + manager.book_locks.locks
+        locks.append(self.lock)
+        for lock in locks:
+            lock.acquire()
+        try:
+            fileno = self.flush()
+            try:
+                os.fsync(fileno)
+            finally:
+                os.close(fileno)
+            catalog.generation = self.generation + 1
+            # Users not given by caller would otherwise lose their loans
+            people = list(self.users.values()) + list(users)
+            catalog.save_snapshot(snapshot + ".tmp", people, manager)
+            os.replace(snapshot + ".tmp", snapshot)
+            self.file.close()
+            self.generation += 1
+            self.file = self.start(self.generation)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+
+# Adapter
+class JsonStream:
+    """
+    Class reading json values one by one from text file, without loading the whole file.
+
+    Constructor parameters:
+     - file (file): Opened text file.
+     - chunk_size (int): Number of characters read from file at once.
+
+    Parameters:
+     - file (file): Opened text file.
+     - chunk_size (int): Number of characters read from file at once.
+     - buffer (str): Characters read but not parsed yet, starting at pos.
+     - pos (int): Position of the next character to parse in buffer.
+
+    Methods:
+     - fill() -> bool: Appends next chunk of file to buffer. Returns False at the end of file.
+     - peek() -> str: Skips whitespaces and returns next character or "" at the end of file.
+     - value() -> object: Decodes next json value. Reads further chunks only while the value
+    may be cut by the end of buffer, so malformed json is reported without reading the rest of
+    file.
+     - items(key: str) -> iterator: Yields one by one items of array stored under key in top
+    level object. Raises KeyError if there is no such key and ValueError for malformed json.
+    """
+
+    WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+    def __init__(self, file, chunk_size: int = 64 * 1024):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def fill(self) -> bool:
+        """
+        Reads next chunk of file.
+        """
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """
+        Shows next meaningful character.
+        """
+        while True:
+            self.pos = self.WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def value(self):
+        """
+        Decodes next value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                # Value cut by the end of buffer fails in its last string or in its
+                # last few characters (literal or escape), anywhere else json is bad
+                cut = e.msg.startswith("Unterminated string") or (
+                    len(self.buffer) - e.pos < 6
+                )
+                if cut and self.fill():
+                    continue
+                raise
+            if end == len(self.buffer) and self.fill():
+                # Number at the end of buffer may continue in the next chunk
+                continue
+            self.pos = end
+            return value
+
+    def items(self, key: str):
+        """
+        Yields items of array stored under given key.
+        """
+        if self.peek() != "{":
+            raise ValueError("Json document is not an object.")
+        self.pos += 1
+        found = False
+        while self.peek() not in ("}", ""):
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            name = self.value()
+            if self.peek() != ":":
+                raise ValueError("Malformed json object.")
+            self.pos += 1
+            if name != key or self.peek() != "[":
+                self.value()
+                continue
+            found = True
+            self.pos += 1
+            while self.peek() != "]":
+                if self.peek() == "":
+                    raise ValueError("Unterminated json array.")
+                if self.peek() == ",":
+                    self.pos += 1
+                    continue
+                yield self.value()
+            self.pos += 1
+        if not found:
+            raise KeyError(key)
+
+
+class DataAdapter:
+    """
+    Class representing Adapter design pattern. Adds books to catalog from given file and writes
+    catalog to file.
+
+    Constructor parameters:
+     - batch_size (int): How many books are collected before they are added to catalog at once.
+     - chunk_size (int): Size in bytes of csv parts read by separate workers in read_many().
+     - rejects (str): Path of file receiving bad csv rows, None by default.
+
+    Parameters:
+     - batch_size (int): How many books are collected before they are added to catalog at once.
+     - chunk_size (int): Size in bytes of csv parts read by separate workers in read_many().
+     - rejects (str): Path of file receiving bad csv rows or None. read_csv() writes there every
+    bad row with its line number and error, replacing earlier content.
+     - mistakes (int): Number of bad records found by the last read.
+     - write_buffer (int): Size in bytes of buffer of written files.
+
+    Methods:
+     - read (catalog: LibraryCatalog, filename: str) -> int: Attempts to recognise file type and
+    send it to proper reader fuction. Returns 1/0 if it is xml and made no/any mistake, returns
+    6/5 if it is csv and made no/any mistake, returns 11/10 if it is json or json lines and made
+    no/any mistake or return -1 if file type is unknown.
+     - read_xml (catalog: LibraryCatalog, filename: str) -> int: Reads xml file and tries to add
+    found books to catalog. Returns 1 if no mistake made or 0 otherwise. The file is parsed
+    incrementally and every book element is freed once added, so memory use does not grow with
+    file size.
+     - read_csv (catalog: LibraryCatalog, filename: str) -> int: Reads csv file and tries to add
+    found books to catalog. Returns 6 if no mistake made or 5 otherwise. Columns are found once
+    from header and rows are converted in chunks of batch_size, so only chunks with bad rows
+    are checked row by row. Bad rows are counted as mistakes and written to rejects file.
+     - read_json (catalog: LibraryCatalog, filename: str) -> int: Reads json file and tries to add
+    found books to catalog. Returns 11 if no mistake made or 10 otherwise. Books are decoded one
+    by one from the "books" array, so memory use does not grow with file size.
+     - read_jsonl (catalog: LibraryCatalog, filename: str) -> int: Reads json lines file (.jsonl
+    or .ndjson) with one book object per line and tries to add found books to catalog. Returns 11
+    if no mistake made or 10 otherwise.
+     - read_many (catalog: LibraryCatalog, filenames: list(str), workers: int) -> list(int): Parses
+    files in worker processes and adds found books to catalog in this process, in the same order
+    as reading files one by one would. Csv files bigger than chunk_size are split into byte ranges
+    of whole lines parsed separately, so they must not contain line breaks inside quoted fields.
+    Returns read() code of every file, or -2 for file that could not be read or parsed to its
+    end (books read before the error are kept).
+     - status (filename: str, mistakes: int) -> int: Returns read() code for file with given
+    number of bad records.
+     - split_csv (filename: str) -> list(tuple(int, int)): Splits csv file into byte ranges of at
+    least chunk_size that start and end on line boundaries.
+     - load (catalog: LibraryCatalog, records: iterable(tuple(Book, int))) -> int: Adds books with
+    their numbers of copies to catalog in batches and returns the number of bad records, which
+    are given as None.
+     - records (filename: str, start: int, end: int) -> iterator(tuple(Book, int)): Yields books
+    from file with their numbers of copies ("total" field, 1 if missing), or None for every bad
+    record.
+     - copies (book: Book, count: int) -> tuple(Book, int): Returns book with its number of
+    copies, or None for bad record. A large count never becomes more than one object.
+     - write (catalog: LibraryCatalog, filename: str) -> int: Attempts to recognise file type
+    and send it to proper writer function. Returns number of written titles or -1 if file type
+    is unknown.
+     - write_xml, write_csv, write_json, write_jsonl (catalog: LibraryCatalog, filename: str) ->
+    int: Write every title with its name, id, year, available and total count and return number
+    of written titles. Catalog is read in batches of batch_size titles, so memory use does not
+    grow with catalog size. Readers take total as number of copies, so written file can be read
+    back into empty catalog; available count is only informative.
+     - rows (catalog: LibraryCatalog) -> iterator(list(tuple(Book, int, int))): Yields catalog
+    rows in batches of batch_size.
+
+    Notes:
+     * Why Adapter? It allows to accomodate to various circumstates. Instead of creating one big
+    confusing method that parses everything, adapter divides problem by creating one switch-case
+    problem that sends arguments to proper subfunction and does its job smoothly. And it can be
+    easily developed further.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 1000,
+        chunk_size: int = 16 * 1024 * 1024,
+        rejects: str = None,
+    ):
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.write_buffer = 1024 * 1024
+        self.rejects = rejects
+        self.mistakes = 0
+
+    def read(self, catalog: LibraryCatalog, filename: str):
+        """
+        Tries to recognise file extension and read it.
+        """
+        if filename.endswith(".xml"):
+            return self.read_xml(catalog, filename)
+        if filename.endswith(".csv"):
+            return self.read_csv(catalog, filename)
+        if filename.endswith(".json"):
+            return self.read_json(catalog, filename)
+        if filename.endswith((".jsonl", ".ndjson")):
+            return self.read_jsonl(catalog, filename)
+        return -1
+
+    def read_many(self, catalog: LibraryCatalog, filenames: list, workers: int = None) -> list:
+        """
+        Reads many files in worker processes.
+        """
+        parts = []
+        failed = set()
+        for filename in filenames:
+            try:
+                if filename.endswith(".csv"):
+                    ranges = self.split_csv(filename)
+                else:
+                    ranges = [(0, None)]
+            except OSError:
+                failed.add(filename)
+                continue
+            parts.extend((filename, start, end) for start, end in ranges)
+        mistakes = dict.fromkeys(filenames, 0)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Results come in order of parts, so books are added in read() order
+            for (filename, _, _), (records, bad, broken) in zip(
+                parts, executor.map(_read_part, parts)
+            ):
+                catalog.add_counts((Book(*i[:3]), i[3]) for i in records)
+                mistakes[filename] += bad
+                if broken:
+                    failed.add(filename)
+        self.mistakes = sum(mistakes.values())
+        return [
+            -2 if filename in failed else self.status(filename, mistakes[filename])
+            for filename in filenames
+        ]
+
+    def status(self, filename: str, mistakes: int) -> int:
+        """
+        Returns read() code for given file and number of its bad records.
+        """
+        if filename.endswith(".xml"):
+            return 0 if mistakes < 1 else 1
+        if filename.endswith(".csv"):
+            return 6 if mistakes < 1 else 5
+        if filename.endswith((".json", ".jsonl", ".ndjson")):
+            return 11 if mistakes < 1 else 10
+        return -1
+
+    def split_csv(self, filename: str) -> list:
+        """
+        Splits csv file into byte ranges of whole lines.
+        """
+        size = os.path.getsize(filename)
+        if size <= self.chunk_size:
+            return [(0, None)]
+        ranges = []
+        with open(filename, "rb") as f:
+            f.readline()
+            start = f.tell()
+            while start < size:
+                f.seek(min(start + self.chunk_size, size))
+                # Move range end to the next line start
+                f.readline()
+                end = f.tell()
+                ranges.append((start, end))
+                start = end
+        return ranges
+
+    def load(self, catalog: LibraryCatalog, records) -> int:
+        """
+        Adds books from records to catalog in batches.
+        """
+        mistakes = 0
+        batch = []
+        for record in records:
+            if record is None:
+                mistakes += 1
+                continue
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                catalog.add_counts(batch)
+                batch = []
+        catalog.add_counts(batch)
+        self.mistakes = mistakes
+        return mistakes
+
+    def records(self, filename: str, start: int = 0, end: int = None):
+        """
+        Yields books from file of any known type.
+        """
+        if filename.endswith(".xml"):
+            return self.records_xml(filename)
+        if filename.endswith(".csv"):
+            return self.records_csv(filename, start, end)
+        if filename.endswith(".json"):
+            return self.records_json(filename)
+        if filename.endswith((".jsonl", ".ndjson")):
+            return self.records_jsonl(filename)
+        return iter(())
+
+    def read_xml(self, catalog: LibraryCatalog, filename: str):
+        """
+        Adds books to catalog from xml file.
+        """
+        if self.load(catalog, self.records_xml(filename)) < 1:
+            return 0
+        return 1
+
+    def records_xml(self, filename: str):
+        """
+        Yields books from xml file.
+        """
+        depth = 0
+        root = None
+        for event, element in ET.iterparse(filename, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if root is None:
+                    root = element
+                continue
+            depth -= 1
+            if depth != 1 or element.tag != "book":
+                continue
+            try:
+                name = element.find("name").text
+                identify = int(element.find("id").text)
+                year = int(element.find("year").text)
+                total = element.find("total")
+                count = 1 if total is None else int(total.text)
+                book = Book(name, identify, year)
+            except (AttributeError, TypeError, ValueError):
+                book, count = None, 1
+            # Drop consumed books, so the tree never holds more than one of them
+            root.clear()
+            yield self.copies(book, count)
+
+    def read_csv(self, catalog: LibraryCatalog, filename: str):
+        """
+        Adds books to catalog from csv file.
+        """
+        if self.rejects is None:
+            mistakes = self.load(catalog, self.records_csv(filename))
+        else:
+            with open(self.rejects, "w", encoding="utf-8", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["line", "error", "row"])
+                mistakes = self.load(
+                    catalog,
+                    self.records_csv(
+                        filename,
+                        reject=lambda line, row, error: writer.writerow(
+                            [line, error] + row
+                        ),
+                    ),
+                )
+        if mistakes < 1:
+            return 6
+        return 5
+
+    def records_csv(self, filename: str, start: int = 0, end: int = None, reject=None):
+        """
+        Yields books from csv file or from its byte range.
+        """
+        if end is None:
+            csvfile = open(filename, mode="r", encoding="utf-8", newline="")
+        else:
+            with open(filename, "rb") as f:
+                header = f.readline()
+                f.seek(start)
+                text = (header + f.read(end - start)).decode("utf-8")
+            csvfile = io.StringIO(text, newline="")
+        with csvfile:
+            reader = csv.reader(csvfile)
+            columns = {j: i for i, j in enumerate(next(reader, []))}
+            missing = [i for i in ("name", "id", "year") if i not in columns]
+            name, identify, year = (columns.get(i) for i in ("name", "id", "year"))
+            total = columns.get("total")
+            while True:
+                # Blank lines are skipped, like csv.DictReader does
+                chunk = [
+                    (row, reader.line_num)
+                    for row in itertools.islice(reader, self.batch_size)
+                    if row
+                ]
+                if not chunk:
+                    return
+                if not missing:
+                    try:
+                        # Chunk with a bad row is checked again row by row
+                        if total is None:
+                            yield from [
+                                (Book(i[name], int(i[identify]), int(i[year])), 1)
+                                for i, _ in chunk
+                            ]
+                            continue
+                        books = [
+                            (
+                                Book(i[name], int(i[identify]), int(i[year])),
+                                int(i[total]) if i[total] else 1,
+                            )
+                            for i, _ in chunk
+                        ]
+                        if any(count < 1 for _, count in books):
+                            raise ValueError
+                        for book, count in books:
+                            yield self.copies(book, count)
+                        continue
+                    except (IndexError, ValueError):
+                        pass
+                for row, line in chunk:
+                    try:
+                        if missing:
+                            raise KeyError(f"missing column {missing[0]}")
+                        book = Book(row[name], int(row[identify]), int(row[year]))
+                        count = 1
+                        if total is not None and total < len(row) and row[total]:
+                            count = int(row[total])
+                        if count < 1:
+                            raise ValueError(f"total {count} is not positive")
+                    except (IndexError, KeyError, ValueError) as e:
+                        if reject is not None:
+                            reject(line, row, f"{type(e).__name__}: {e}")
+                        yield None
+                        continue
+                    yield self.copies(book, count)
+
+    def read_json(self, catalog: LibraryCatalog, filename: str):
+        """
+        Adds books to catalog from json file.
+        """
+        if self.load(catalog, self.records_json(filename)) < 1:
+            return 11
+        return 10
+
+    def records_json(self, filename: str):
+        """
+        Yields books from json file.
+        """
+        with open(filename, "r", encoding="utf-8") as f:
+            for book in JsonStream(f).items("books"):
+                try:
+                    count = int(book.get("total", 1))
+                    book = Book(book["name"], int(book["id"]), int(book["year"]))
+                except (AttributeError, KeyError, TypeError, ValueError):
+                    book, count = None, 1
+                yield self.copies(book, count)
+
+    def read_jsonl(self, catalog: LibraryCatalog, filename: str):
+        """
+        Adds books to catalog from json lines file.
+        """
+        if self.load(catalog, self.records_jsonl(filename)) < 1:
+            return 11
+        return 10
+
+    def records_jsonl(self, filename: str):
+        """
+        Yields books from json lines file.
+        """
+        with open(filename, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    book = json.loads(line)
+                    count = int(book.get("total", 1))
+                    book = Book(book["name"], int(book["id"]), int(book["year"]))
+                except (AttributeError, KeyError, TypeError, ValueError):
+                    book, count = None, 1
+                yield self.copies(book, count)
+
+    @staticmethod
+    def copies(book: Book, count: int) -> tuple:
+        """
+        Pairs book with its number of copies.
+        """
+        if book is None or count < 1:
+            return None
+        return book, count
+
+    def write(self, catalog: LibraryCatalog, filename: str) -> int:
+        """
+        Tries to recognise file extension and write catalog to it.
+        """
+        if filename.endswith(".xml"):
+            return self.write_xml(catalog, filename)
+        if filename.endswith(".csv"):
+            return self.write_csv(catalog, filename)
+        if filename.endswith(".json"):
+            return self.write_json(catalog, filename)
+        if filename.endswith((".jsonl", ".ndjson")):
+            return self.write_jsonl(catalog, filename)
+        return -1
+
+    def rows(self, catalog: LibraryCatalog):
+        """
+        Yields catalog rows in batches.
+        """
+        start = 0
+        while start < len(catalog.store):
+            batch = catalog.store.rows(start, start + self.batch_size)
+            start += len(batch)
+            yield batch
+
+    def write_csv(self, catalog: LibraryCatalog, filename: str) -> int:
+        """
+        Writes catalog to csv file.
+        """
+        written = 0
+        with open(
+            filename, "w", encoding="utf-8", newline="", buffering=self.write_buffer
+        ) as f:
+            writer = csv.writer(f)
+            writer.writerow(["name", "id", "year", "available", "total"])
+            for batch in self.rows(catalog):
+                writer.writerows(
+                    (i.name, i.identify, i.year, j, k) for i, j, k in batch
+                )
+                written += len(batch)
+        return written
+
+    def write_json(self, catalog: LibraryCatalog, filename: str) -> int:
+        """
+        Writes catalog to json file.
+        """
+        written = 0
+        with open(filename, "w", encoding="utf-8", buffering=self.write_buffer) as f:
+            f.write('{"books": [')
+            for batch in self.rows(catalog):
+                f.write(
+                    ("," if written else "")
+                    + ",".join(
+                        json.dumps(
+                            {
+                                "name": i.name,
+                                "id": i.identify,
+                                "year": i.year,
+                                "available": j,
+                                "total": k,
+                            }
+                        )
+                        for i, j, k in batch
+                    )
+                )
+                written += len(batch)
+            f.write("]}\n")
+        return written
+
+    def write_jsonl(self, catalog: LibraryCatalog, filename: str) -> int:
+        """
+        Writes catalog to json lines file.
+        """
+        written = 0
+        with open(filename, "w", encoding="utf-8", buffering=self.write_buffer) as f:
+            for batch in self.rows(catalog):
+                f.write(
+                    "".join(
+                        json.dumps(
+                            {
+                                "name": i.name,
+                                "id": i.identify,
+                                "year": i.year,
+                                "available": j,
+                                "total": k,
+                            }
+                        )
+                        + "\n"
+                        for i, j, k in batch
+                    )
+                )
+                written += len(batch)
+        return written
+
+    def write_xml(self, catalog: LibraryCatalog, filename: str) -> int:
+        """
+        Writes catalog to xml file.
+        """
+        written = 0
+        with open(filename, "w", encoding="utf-8", buffering=self.write_buffer) as f:
+            f.write('<?xml version="1.0" encoding="utf-8"?>\n<books>\n')
+            for batch in self.rows(catalog):
+                f.write(
+                    "".join(
+                        f"<book><name>{escape(i.name)}</name><id>{i.identify}</id>"
+                        f"<year>{i.year}</year><available>{j}</available>"
+                        f"<total>{k}</total></book>\n"
+                        for i, j, k in batch
+                    )
+                )
+                written += len(batch)
+            f.write("</books>\n")
+        return written
+
+
+def _read_part(part: tuple) -> tuple:
+    """
+    Reads one file or csv byte range in worker process for DataAdapter.read_many().
+    """
+    filename, start, end = part
+    records = []
+    mistakes = 0
+    try:
+        for record in DataAdapter().records(filename, start, end):
+            if record is None:
+                mistakes += 1
+            else:
+                book, count = record
+                records.append((book.name, book.identify, book.year, count))
+    except (KeyError, OSError, SyntaxError, ValueError):
+        # Missing or malformed file fails only its own status, not the whole import
+        return records, mistakes, True
+    return records, mistakes, False
+
+
+# Factory
+class UserFactory:
+    """
+    Class implementing Factory design pattern to create new users.
+
+    Constructor parameters:
+     - registry (UserRegistry): Registry receiving every created user, None by default.
+
+    Parameters:
+     - types (list(str)): Valid user types.
+     - registry (UserRegistry): Registry receiving every created user or None.
+
+    Methods:
+     - create_user(user: str, name: str) -> User: Tries to create a proper user class. Return
+    Student, Teacher or Librarian class with chosen name or raises Error for different class names.
+     - check_user_type(user: str) -> bool: Checks whether given user type is valid.
+
+    Notes:
+     * Why Factory? It is a simple solution to create multiple various accounts. Now it is obvious
+    what classes are available plus method input can be universal.
+    """
+
+    def __init__(self, registry=None):
+        self.types = ["student", "teacher", "librarian"]
+        self.registry = registry
+
+    def create_user(self, user: str, name: str) -> User:
+        """
+        Tries to create an user from given type and user name.
+        """
+        if user == "student":
+            created = Student(name)
+        elif user == "teacher":
+            created = Teacher(name)
+        elif user == "librarian":
+            created = Librarian(name)
+        else:
+            raise TypeError("Unknown user kind inserted.")
+        if self.registry is not None:
+            self.registry.register(created)
+        return created
+
+    def check_user_type(self, user: str) -> bool:
+        """
+        Checks whether given user type is valid.
+        """
+        if user in self.types:
+            return True
+        return False
+
+
+class UserRegistry:
+    """
+    Class storing users, so they can be found by name or ID.
+
+    Parameters:
+     - names (dict(str: User)): Users by their names.
+     - ids (dict(int: User)): Users by their IDs.
+     - next_id (int): ID given to next registered user.
+     - lock (Lock): Lock guarding registration.
+
+    Methods:
+     - register(user: User) -> int: Stores user, gives it next ID and returns it. Registering
+    the same user again only returns its ID. Raises ValueError if another user with the same
+    name is registered.
+     - get(name: str) -> User: Returns user with given name or None.
+     - by_id(identify: int) -> User: Returns user with given ID or None.
+     - remove(user: User): Removes user from registry.
+    """
+
+    def __init__(self):
+        self.names: dict[str, User] = {}
+        self.ids: dict[int, User] = {}
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.names
+
+    def __iter__(self):
+        return iter(list(self.names.values()))
+
+    def register(self, user: User) -> int:
+        """
+        Stores user.
+        """
+        with self.lock:
+            if self.names.get(user.name, user) is not user:
+                raise ValueError(f"User {user.name} is already registered.")
+            if user.name not in self.names:
+                user.identify = self.next_id
+                self.next_id += 1
+                self.names[user.name] = user
+                self.ids[user.identify] = user
+            return user.identify
+
+    def get(self, name: str) -> User:
+        """
+        Finds user by name.
+        """
+        return self.names.get(name)
+
+    def by_id(self, identify: int) -> User:
+        """
+        Finds user by ID.
+        """
+        return self.ids.get(identify)
+
+    def remove(self, user: User):
+        """
+        Removes user.
+        """
+        with self.lock:
+            del self.names[user.name]
+            del self.ids[user.identify]
+
+
+# Instrumentation
+class Instrumentation:
+    """
+    Class collecting latency histograms, result code counters and size gauges of library
+    operations, see ActionInterface.
+
+    Constructor parameters:
+     - buckets (tuple(float)): Upper bounds of latency buckets in seconds, BUCKETS by default.
+
+    Parameters:
+     - buckets (tuple(float)): Upper bounds of latency buckets in seconds, the last is infinity.
+     - latency (dict(str: list(int))): Count of calls in every bucket, by operation.
+     - sums (dict(str: float)): Total time of calls, by operation.
+     - codes (dict(str: dict(int: int))): Count of every returned code, by operation.
+     - catalog (LibraryCatalog): Catalog measured by gauges, None until watch() is called.
+     - manager (ObserverManager): Manager measured by gauges, None until watch() is called.
+     - lock (Lock): Lock guarding counters.
+
+    Methods:
+     - watch(catalog: LibraryCatalog, manager: ObserverManager): Chooses catalog and manager
+    measured by gauges.
+     - observe(operation: str, seconds: float, codes: iterable(int)): Records one call taking
+    given time and its result codes (many for batches, none for operations without codes).
+    Codes may also be given as dict of code and its count, like add_books() returns.
+     - gauges() -> dict(str: int): Returns current number of titles, observers, waited titles,
+    waitlist entries and queued notifications.
+     - snapshot() -> dict: Returns all metrics as dictionary.
+     - prometheus() -> str: Returns all metrics in Prometheus text format.
+    """
+
+    BUCKETS = (1e-6, 1e-5, 1e-4, 2.5e-4, 1e-3, 2.5e-3, 1e-2, 0.1, 1.0, 10.0)
+
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self.latency: dict[str, list[int]] = {}
+        self.sums: dict[str, float] = {}
+        self.codes: dict[str, dict[int, int]] = {}
+        self.catalog = None
+        self.manager = None
+        self.lock = threading.Lock()
+
+    def watch(self, catalog: LibraryCatalog, manager: ObserverManager):
+        """
+        Chooses measured catalog and manager.
+        """
+        self.catalog = catalog
+        self.manager = manager
+
+    def observe(self, operation: str, seconds: float, codes=()):
+        """
+        Records one call of operation.
+        """
+        slot = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            if operation not in self.latency:
+                self.latency[operation] = [0] * len(self.buckets)
+                self.sums[operation] = 0.0
+                self.codes[operation] = {}
+            self.latency[operation][slot] += 1
+            self.sums[operation] += seconds
+            counts = self.codes[operation]
+            pairs = (
+                codes.items() if isinstance(codes, dict) else ((i, 1) for i in codes)
+            )
+            for code, count in pairs:
+                counts[code] = counts.get(code, 0) + count
+
+    def gauges(self) -> dict:
+        """
+        Shows sizes of catalog and waitlists.
+        """
+        values = {}
+        if self.catalog is not None:
+            values["catalog_titles"] = len(self.catalog.store)
+        if self.manager is not None:
+            waiters = list(self.manager.waiters.values())
+            values["observers"] = len(self.manager.users)
+            values["waited_titles"] = len(waiters)
+            values["waitlist_entries"] = sum(len(i) for i in waiters)
+            if self.manager.dispatcher is not None:
+                values["queued_notifications"] = self.manager.dispatcher.events.qsize()
+        return values
+
+    def snapshot(self) -> dict:
+        """
+        Shows all metrics.
+        """
+        with self.lock:
+            latency = {}
+            for operation, counts in self.latency.items():
+                total = 0
+                cumulative = {}
+                for bound, count in zip(self.buckets, counts):
+                    total += count
+                    cumulative[bound] = total
+                latency[operation] = {
+                    "buckets": cumulative,
+                    "count": total,
+                    "sum": self.sums[operation],
+                }
+            codes = {i: dict(j) for i, j in self.codes.items()}
+        return {"latency": latency, "codes": codes, "gauges": self.gauges()}
+
+    def prometheus(self) -> str:
+        """
+        Shows all metrics in Prometheus text format.
+        """
+        metrics = self.snapshot()
+        lines = ["# TYPE library_operation_seconds histogram"]
+        for operation, histogram in metrics["latency"].items():
+            for bound, count in histogram["buckets"].items():
+                bound = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(
+                    f'library_operation_seconds_bucket{{operation="{operation}",'
+                    f'le="{bound}"}} {count}'
+                )
+            lines.append(
+                f'library_operation_seconds_sum{{operation="{operation}"}} '
+                f'{histogram["sum"]!r}'
+            )
+            lines.append(
+                f'library_operation_seconds_count{{operation="{operation}"}} '
+                f'{histogram["count"]}'
+            )
+        lines.append("# TYPE library_operation_results_total counter")
+        for operation, counts in metrics["codes"].items():
+            for code, count in sorted(counts.items()):
+                lines.append(
+                    f'library_operation_results_total{{operation="{operation}",'
+                    f'code="{code}"}} {count}'
+                )
+        for name, value in metrics["gauges"].items():
+            lines.append(f"# TYPE library_{name} gauge")
+            lines.append(f"library_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Facade
+class ActionInterface:
+    """
+    Class implementing Facade design pattern to show available commands as simple 'interface'.
+
+    Constructor parameters:
+     - catalog (LibraryCatalog): Catalog that does every method presented by interface.
+     - manager (ObserverManager): Manager for Observers awaiting for books.
+     - instrumentation (Instrumentation): Collector of metrics, None by default.
+
+    Parameters:
+     - catalog (LibraryCatalog): Catalog that does every method presented by interface.
+     - manager (ObserverManager): Manager for Observers awaiting for books.
+     - instrumentation (Instrumentation): Collector of metrics, None if metrics are disabled.
 
     Methods:
      - get_catalog() -> dict: Returns full catalog.
      - get_next() -> str: Returns next book in catalog.
+     - show_books(cursor: str, size: int) -> tuple(list(str), str): Returns up to size books
+    starting at cursor and a continuation token, see LibraryCatalog.page().
      - add_book(book: Book) -> int: Adds book to catalog. Increases count and returns 1 if book
     already exists, otherwise returns 2.
+     - add_books(books: iterable(Book)) -> dict(int: int): Adds many books to catalog at once and
+    returns how many became new titles (key 2) and new copies (key 1).
      - borrow_book(user: User, identify: int, manager: ObserverManager) -> int: Tries to find a
     book by its ID and declare one of copies as ordered by user. Decreases book count and returns
     1 if user has not reached book limit and book is available, 0 if book is unavailable right
@@ -551,22 +3126,72 @@ class ActionInterface:
     list from "Ordered" to "Borrowed". Changes status and returns 1 if user has this book and it
     is "Ordered", -1 if the book is not "Ordered" or -2 if user does not have this book in its
     list.
+     - release_book(user: User, identify: int) -> int: Gives up copy of book held for user, see
+    LibraryCatalog.release().
+     - borrow_many(operations: iterable(tuple(User, int))) -> list(int): Borrows many books at
+    once, see LibraryCatalog.borrow_many().
+     - return_many(operations: iterable(tuple(User, int))) -> list(int): Returns many books at
+    once, see LibraryCatalog.return_many().
+     - search_books(title: str, prefix: str, start: int, stop: int, limit: int) -> list(str):
+    Returns found books with their counts, see LibraryCatalog.search().
+     - read(filename: str) -> int: Imports books from file, see DataAdapter.read().
+     - read_many(filenames: list(str), workers: int) -> list(int): Imports files in worker
+    processes, see DataAdapter.read_many().
+     - measure(operation: str, method: callable, *args) -> any: Calls method and records its
+    time and result codes in instrumentation.
+
+    Adding, borrowing, returning, updating and importing books are measured when instrumentation
+    is given. Without it every call costs only one more comparison.
 
     Notes:
      * Why Facade? It allows to show available commands that are located in more advanced and
     complicated class. Here everything looks better and complex processing is hidden from view.
     """
 
-    def __init__(self, catalog: LibraryCatalog, manager: ObserverManager):
+    def __init__(
+        self,
+        catalog: LibraryCatalog,
+        manager: ObserverManager,
+        instrumentation: Instrumentation = None,
+    ):
         self.catalog = catalog
         self.manager = manager
+        self.instrumentation = instrumentation
+        if instrumentation is not None:
+            instrumentation.watch(catalog, manager)
+
+    def measure(self, operation: str, method, *args):
+        """
+        Calls method and records its metrics.
+        """
+        start = time.perf_counter()
+        outcome = method(*args)
+        seconds = time.perf_counter() - start
+        if isinstance(outcome, (list, dict)):
+            codes = outcome
+        elif isinstance(outcome, int):
+            codes = (outcome,)
+        else:
+            codes = ()
+        self.instrumentation.observe(operation, seconds, codes)
+        return outcome
 
     def add_book(self, book: Book) -> int:
         """
         Adds book to catalog.
         """
+        if self.instrumentation is not None:
+            return self.measure("add_book", self.catalog.add_book, book)
         return self.catalog.add_book(book)
 
+    def add_books(self, books) -> dict:
+        """
+        Adds many books to catalog.
+        """
+        if self.instrumentation is not None:
+            return self.measure("add_books", self.catalog.add_books, books)
+        return self.catalog.add_books(books)
+
     def show_catalog(self) -> dict:
         """
         Shows whole catalog.
@@ -579,20 +3204,670 @@ class ActionInterface:
         """
         return self.catalog.get_next()
 
+    def show_books(self, cursor: str = None, size: int = 10) -> tuple:
+        """
+        Shows part of catalog.
+        """
+        batch, token = self.catalog.page(cursor, size)
+        return [self.catalog.describe(book) for book, _, _ in batch], token
+
     def borrow_book(self, user: User, identify: int) -> int:
         """
         Borrows book for given user.
         """
+        if self.instrumentation is not None:
+            return self.measure(
+                "borrow_book", self.catalog.borrow_book, user, identify, self.manager
+            )
         return self.catalog.borrow_book(user, identify, self.manager)
 
     def return_book(self, user: User, identify: int) -> int:
         """
         Returns book to catalog.
         """
+        if self.instrumentation is not None:
+            return self.measure(
+                "return_book", self.catalog.return_book, user, identify, self.manager
+            )
         return self.catalog.return_book(user, identify, self.manager)
 
     def update_borrow(self, user: User, identify: int) -> int:
         """
         Updates book status.
         """
+        if self.instrumentation is not None:
+            return self.measure(
+                "update_borrow", self.catalog.update_borrow, user, identify
+            )
         return self.catalog.update_borrow(user, identify)
+
+    def release_book(self, user: User, identify: int) -> int:
+        """
+        Gives up copy held for given user.
+        """
+        if self.instrumentation is not None:
+            return self.measure(
+                "release_book", self.catalog.release, user, identify, self.manager
+            )
+        return self.catalog.release(user, identify, self.manager)
+
+    def borrow_many(self, operations) -> list:
+        """
+        Borrows many books.
+        """
+        if self.instrumentation is not None:
+            return self.measure(
+                "borrow_many", self.catalog.borrow_many, operations, self.manager
+            )
+        return self.catalog.borrow_many(operations, self.manager)
+
+    def return_many(self, operations) -> list:
+        """
+        Returns many books to catalog.
+        """
+        if self.instrumentation is not None:
+            return self.measure(
+                "return_many", self.catalog.return_many, operations, self.manager
+            )
+        return self.catalog.return_many(operations, self.manager)
+
+    def search_books(
+        self,
+        title: str = None,
+        prefix: str = None,
+        start: int = None,
+        stop: int = None,
+        limit: int = None,
+    ) -> list:
+        """
+        Finds books.
+        """
+        found = self.catalog.search(title, prefix, start, stop, limit)
+        return [self.catalog.describe(book) for book in found]
+
+    def read(self, filename: str) -> int:
+        """
+        Imports books from file.
+        """
+        # Own adapter for every import, as adapter remembers mistakes of its last read
+        if self.instrumentation is not None:
+            return self.measure("read", DataAdapter().read, self.catalog, filename)
+        return DataAdapter().read(self.catalog, filename)
+
+    def read_many(self, filenames: list, workers: int = None) -> list:
+        """
+        Imports books from many files.
+        """
+        if self.instrumentation is not None:
+            return self.measure(
+                "read_many", DataAdapter().read_many, self.catalog, filenames, workers
+            )
+        return DataAdapter().read_many(self.catalog, filenames, workers)
+
+
+# Sharding
+class ShardedActionInterface:
+    """
+    Class with the same commands as ActionInterface, whose books are split by ID among worker
+    processes. Every process (shard) holds its own LibraryCatalog and ObserverManager with
+    books whose ID gives its number modulo number of shards, so lending of different titles
+    uses many processor cores.
+
+    Constructor parameters:
+     - shards (int): Number of worker processes, number of processor cores by default.
+     - store (str): Storage used by shards, "dict" (DictStore) or "column" (ColumnStore).
+
+    Parameters:
+     - connections (list(Connection)): Pipes to shards.
+     - processes (list(Process)): Shard processes.
+     - shard_locks (list(Lock)): Locks of pipes, so every request gets its own answer.
+     - user_locks (LockStripes): Locks of users.
+     - users (dict(str: User)): Users by name, the first object given for every name.
+
+    Methods:
+     - shard(identify: int) -> int: Returns number of shard holding book with given ID.
+     - member(user: User) -> User: Returns user known under name of given user, registering it
+    if the name is new.
+     - call(requests: dict(int: list(tuple))) -> dict(int: list): Sends lists of requests to
+    shards at once and returns their answers. Shards work on them in parallel.
+     - lend(operation: str, user: User, identify: int) -> tuple(int, tuple): Sends one
+    lending operation to shard of book and returns its code and borrowed book.
+     - settle(operation: str, user: User, identify: int, answer: tuple) -> int: Copies answer of
+    shard to user's book list and returns its code.
+     - batch(operation: str, items: list(tuple(int, User, int)), codes: list(int)): Sends many
+    lending operations to their shards at once and puts codes at their positions.
+     - add_book(book: Book) -> int: See ActionInterface.add_book().
+     - add_books(books: iterable(Book)) -> dict(int: int): See ActionInterface.add_books().
+     - show_catalog() -> dict: Returns full catalog gathered from shards.
+     - borrow_book(user: User, identify: int) -> int: See ActionInterface.borrow_book().
+     - return_book(user: User, identify: int) -> int: See ActionInterface.return_book().
+     - update_borrow(user: User, identify: int) -> int: See ActionInterface.update_borrow().
+     - borrow_many(operations: iterable(tuple(User, int))) -> list(int): See
+    ActionInterface.borrow_many(). Users who cannot reach their limit in the batch are served by
+    all shards in parallel, the others one book at a time.
+     - return_many(operations: iterable(tuple(User, int))) -> list(int): See
+    ActionInterface.return_many(). Users who keep a book after the batch are served by all
+    shards in parallel, the others one book at a time.
+     - search_books(title: str, prefix: str, start: int, stop: int, limit: int) -> list(str): See
+    ActionInterface.search_books(), books are ordered by shard.
+     - get_infos(user: User) -> list(str): Returns notifications of user from all shards.
+     - close(): Stops shards.
+
+    Users stay in process of router and their book lists are updated with answers of shards.
+    Router checks book limits with user's books from all shards while holding user's lock, so
+    limits stay correct although every shard knows only its own part of user's books. Shards
+    know users by name, so router does too: book lists are kept by the first User object given
+    for every name, and other objects with that name act on it.
+    """
+
+    def __init__(self, shards: int = None, store: str = "dict"):
+        context = multiprocessing.get_context("spawn")
+        self.connections = []
+        self.processes = []
+        for _ in range(shards or os.cpu_count() or 1):
+            mine, theirs = context.Pipe()
+            process = context.Process(
+                target=_serve_shard, args=(theirs, store), daemon=True
+            )
+            process.start()
+            self.connections.append(mine)
+            self.processes.append(process)
+        self.shard_locks = [threading.Lock() for _ in self.connections]
+        self.user_locks = LockStripes()
+        self.users = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def shard(self, identify: int) -> int:
+        """
+        Finds shard of book.
+        """
+        return identify % len(self.connections)
+
+    def member(self, user: User) -> User:
+        """
+        Finds user known under the same name.
+        """
+        return self.users.setdefault(user.name, user)
+
+    def call(self, requests: dict) -> dict:
+        """
+        Sends requests to shards and waits for answers.
+        """
+        numbers = sorted(requests)
+        # Locks are always taken in order of shards, so batches cannot deadlock
+        for number in numbers:
+            self.shard_locks[number].acquire()
+        try:
+            for number in numbers:
+                self.connections[number].send(requests[number])
+            return {number: self.connections[number].recv() for number in numbers}
+        finally:
+            for number in numbers:
+                self.shard_locks[number].release()
+
+    def lend(self, operation: str, user: User, identify: int) -> tuple:
+        """
+        Sends one lending operation of user to shard of book.
+        """
+        number = self.shard(identify)
+        request = (operation, type(user).__name__.lower(), user.name, identify)
+        return self.call({number: [request]})[number][0]
+
+    def add_book(self, book: Book) -> int:
+        """
+        Adds book to catalog.
+        """
+        number = self.shard(book.identify)
+        request = ("add", book.name, book.identify, book.year, 1)
+        return self.call({number: [request]})[number][0]
+
+    def add_books(self, books) -> dict:
+        """
+        Adds many books to catalog.
+        """
+        groups = {}
+        for book in books:
+            key = (book.name, book.identify, book.year)
+            groups[key] = groups.get(key, 0) + 1
+        requests = {}
+        for (name, identify, year), count in groups.items():
+            requests.setdefault(self.shard(identify), []).append(
+                ("add", name, identify, year, count)
+            )
+        outcome = {1: 0, 2: 0}
+        for number, codes in self.call(requests).items():
+            for request, code in zip(requests[number], codes):
+                count = request[4]
+                if code == 2:
+                    # First copy created the title, the rest are copies
+                    outcome[2] += 1
+                    count -= 1
+                outcome[1] += count
+        return outcome
+
+    def show_catalog(self) -> dict:
+        """
+        Shows whole catalog.
+        """
+        answers = self.call({i: [("rows",)] for i in range(len(self.connections))})
+        catalog = {}
+        for number in sorted(answers):
+            for name, identify, year, available, total in answers[number][0]:
+                catalog[Book(name, identify, year)] = [available, total]
+        return catalog
+
+    def settle(self, operation: str, user: User, identify: int, answer: tuple) -> int:
+        """
+        Copies result of lending operation to user's book list.
+        """
+        code, fields = answer
+        if code != 1:
+            return code
+        if operation == "borrow":
+            user.set_loan(Book(*fields), "Ordered")
+            return code
+        book = user.loan(identify)
+        # Shard may know a loan that this process does not, leave such list as it is
+        if book is not None and operation == "return":
+            user.remove_loan(book)
+        elif book is not None:
+            user.set_loan(book, "Borrowed")
+        return code
+
+    def borrow_book(self, user: User, identify: int) -> int:
+        """
+        Borrows book for given user.
+        """
+        user = self.member(user)
+        with self.user_locks.get(user.name):
+            if user.limit <= len(user.books):
+                # Max book limit reached
+                return -1
+            answer = self.lend("borrow", user, identify)
+            return self.settle("borrow", user, identify, answer)
+
+    def return_book(self, user: User, identify: int) -> int:
+        """
+        Returns book to catalog.
+        """
+        user = self.member(user)
+        with self.user_locks.get(user.name):
+            if len(user.books) < 1:
+                # What does user want to return?
+                return -1
+            answer = self.lend("return", user, identify)
+            return self.settle("return", user, identify, answer)
+
+    def update_borrow(self, user: User, identify: int) -> int:
+        """
+        Updates book status.
+        """
+        user = self.member(user)
+        with self.user_locks.get(user.name):
+            answer = self.lend("update", user, identify)
+            return self.settle("update", user, identify, answer)
+
+    def batch(self, operation: str, items: list, codes: list):
+        """
+        Sends lending operations to all shards at once and stores their codes.
+        """
+        requests = {}
+        for position, user, identify in items:
+            requests.setdefault(self.shard(identify), []).append(
+                (position, user, identify)
+            )
+        answers = self.call(
+            {
+                number: [
+                    (operation, type(user).__name__.lower(), user.name, identify)
+                    for _, user, identify in group
+                ]
+                for number, group in requests.items()
+            }
+        )
+        for number, group in requests.items():
+            for (position, user, identify), answer in zip(group, answers[number]):
+                codes[position] = self.settle(operation, user, identify, answer)
+
+    def borrow_many(self, operations) -> list:
+        """
+        Borrows many books.
+        """
+        groups = {
+            name: (self.member(user), items)
+            for name, (user, items) in LibraryCatalog.group(operations).items()
+        }
+        codes = [0] * sum(len(i[1]) for i in groups.values())
+        parallel = []
+        single = []
+        locks = sorted(
+            {self.user_locks.get(name) for name in groups},
+            key=self.user_locks.locks.index,
+        )
+        for lock in locks:
+            lock.acquire()
+        try:
+            for user, items in groups.values():
+                if len(user.books) + len(items) <= user.limit:
+                    parallel.extend((position, user, i) for position, i in items)
+                else:
+                    single.append((user, items))
+            self.batch("borrow", parallel, codes)
+            for user, items in single:
+                for position, identify in items:
+                    if user.limit <= len(user.books):
+                        codes[position] = -1
+                        continue
+                    answer = self.lend("borrow", user, identify)
+                    codes[position] = self.settle("borrow", user, identify, answer)
+        finally:
+            for lock in locks:
+                lock.release()
+        return codes
+
+    def return_many(self, operations) -> list:
+        """
+        Returns many books to catalog.
+        """
+        groups = {
+            name: (self.member(user), items)
+            for name, (user, items) in LibraryCatalog.group(operations).items()
+        }
+        codes = [0] * sum(len(i[1]) for i in groups.values())
+        parallel = []
+        locks = sorted(
+            {self.user_locks.get(name) for name in groups},
+            key=self.user_locks.locks.index,
+        )
+        for lock in locks:
+            lock.acquire()
+        try:
+            for user, items in groups.values():
+                if not user.books:
+                    for position, _ in items:
+                        codes[position] = -1
+                    continue
+                if {i.identify for i in user.books}.difference(i for _, i in items):
+                    # User keeps a book, so no item sees an empty list
+                    parallel.extend((position, user, i) for position, i in items)
+                    continue
+                for position, identify in items:
+                    if len(user.books) < 1:
+                        codes[position] = -1
+                        continue
+                    answer = self.lend("return", user, identify)
+                    codes[position] = self.settle("return", user, identify, answer)
+            self.batch("return", parallel, codes)
+        finally:
+            for lock in locks:
+                lock.release()
+        return codes
+
+    def search_books(
+        self,
+        title: str = None,
+        prefix: str = None,
+        start: int = None,
+        stop: int = None,
+        limit: int = None,
+    ) -> list:
+        """
+        Finds books.
+        """
+        request = ("search", title, prefix, start, stop, limit)
+        answers = self.call({i: [request] for i in range(len(self.connections))})
+        found = [j for i in sorted(answers) for j in answers[i][0]]
+        return found[:limit]
+
+    def get_infos(self, user: User) -> list:
+        """
+        Shows notifications of user.
+        """
+        request = ("infos", user.name)
+        answers = self.call({i: [request] for i in range(len(self.connections))})
+        return [j for i in sorted(answers) for j in answers[i][0]]
+
+    def close(self):
+        """
+        Stops shards.
+        """
+        for number, connection in enumerate(self.connections):
+            with self.shard_locks[number]:
+                connection.send(None)
+        for process in self.processes:
+            process.join()
+
+
+def _serve_shard(connection, store: str):
+    """
+    Runs shard of ShardedActionInterface until it receives None.
+    """
+    catalog = LibraryCatalog()
+    catalog.use_store(ColumnStore() if store == "column" else DictStore())
+    manager = ObserverManager()
+    factory = UserFactory()
+    users = {}
+    while True:
+        requests = connection.recv()
+        if requests is None:
+            return
+        answers = []
+        for request in requests:
+            operation = request[0]
+            if operation == "add":
+                book = Book(request[1], request[2], request[3])
+                answers.append(catalog.add_copies(book, request[4]))
+                continue
+            if operation == "rows":
+                answers.append(
+                    [
+                        (i.name, i.identify, i.year, j, k)
+                        for i, j, k in catalog.store.rows(0, len(catalog.store))
+                    ]
+                )
+                continue
+            if operation == "search":
+                answers.append(
+                    [catalog.describe(i) for i in catalog.search(*request[1:])]
+                )
+                continue
+            if operation == "infos":
+                observer = manager.users.get(request[1])
+                answers.append([] if observer is None else observer.infos)
+                continue
+            _, kind, name, identify = request
+            if name not in users:
+                users[name] = factory.create_user(kind, name)
+            user = users[name]
+            if operation == "borrow":
+                code = catalog.borrow_book(user, identify, manager)
+            elif operation == "update":
+                code = catalog.update_borrow(user, identify)
+            elif user.books:
+                code = catalog.return_book(user, identify, manager)
+            else:
+                # User has books only in other shards, so this one was not borrowed
+                code = -3 if catalog.find(identify) is None else -2
+            book = catalog.find(identify) if code == 1 else None
+            fields = None if book is None else (book.name, book.identify, book.year)
+            answers.append((code, fields))
+        connection.send(answers)
+
+
+# Facade for asyncio
+class AsyncActionInterface:
+    """
+    Class implementing Facade design pattern for asyncio applications. Methods are coroutines
+    returning the same codes as ActionInterface.
+
+    Lending operations only touch memory and take microseconds, so they run directly in event
+    loop instead of being sent to executor. Journal is synced by its own timer thread, so
+    lending never waits for disk. Only file imports and operations on SqliteStore, which block
+    on disk, run in default executor.
+
+    Constructor parameters:
+     - catalog (LibraryCatalog): Catalog that does every method presented by interface.
+     - manager (ObserverManager): Manager for Observers awaiting for books.
+     - instrumentation (Instrumentation): Collector of metrics, None by default.
+
+    Parameters:
+     - interface (ActionInterface): Synchronous interface doing the work.
+     - streams (dict(str: set(asyncio.Queue))): Queues of open notification streams by user's
+    name.
+     - loop (AbstractEventLoop): Event loop of notification streams, bound by the first stream.
+    Notifications are dropped once it is closed.
+
+    Methods:
+     - run(method: callable, *args) -> object: Calls method in default executor.
+     - call(method: callable, *args) -> object: Calls lending method in event loop, or in
+    default executor if catalog keeps books in SqliteStore.
+     - add_book(book: Book) -> int: See ActionInterface.add_book().
+     - add_books(books: iterable(Book)) -> dict(int: int): See ActionInterface.add_books().
+     - borrow_book(user: User, identify: int) -> int: See ActionInterface.borrow_book().
+     - return_book(user: User, identify: int) -> int: See ActionInterface.return_book().
+     - update_borrow(user: User, identify: int) -> int: See ActionInterface.update_borrow().
+     - borrow_many(operations: iterable(tuple(User, int))) -> list(int): See
+    ActionInterface.borrow_many().
+     - return_many(operations: iterable(tuple(User, int))) -> list(int): See
+    ActionInterface.return_many().
+     - read(filename: str) -> int: Imports file in executor, see DataAdapter.read().
+     - read_many(filenames: list(str), workers: int) -> list(int): Imports files in worker
+    processes, see ActionInterface.read_many().
+     - notifications(user: User) -> async iterator(str): Yields notifications sent to user from
+    the moment of subscribing until close_notifications() is called.
+     - close_notifications(user: User): Ends all notification streams of user.
+    """
+
+    def __init__(
+        self,
+        catalog: LibraryCatalog,
+        manager: ObserverManager,
+        instrumentation: Instrumentation = None,
+    ):
+        self.interface = ActionInterface(catalog, manager, instrumentation)
+        self.streams = {}
+        self.loop = None
+        manager.listeners.append(self.deliver)
+
+    async def run(self, method, *args):
+        """
+        Calls blocking method in executor.
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, method, *args)
+
+    async def call(self, method, *args):
+        """
+        Calls lending method in event loop, unless store blocks on disk.
+        """
+        if isinstance(self.interface.catalog.store, SqliteStore):
+            return await self.run(method, *args)
+        return method(*args)
+
+    async def add_book(self, book: Book) -> int:
+        """
+        Adds book to catalog.
+        """
+        return await self.call(self.interface.add_book, book)
+
+    async def add_books(self, books) -> dict:
+        """
+        Adds many books to catalog.
+        """
+        return await self.call(self.interface.add_books, books)
+
+    async def borrow_book(self, user: User, identify: int) -> int:
+        """
+        Borrows book for given user.
+        """
+        return await self.call(self.interface.borrow_book, user, identify)
+
+    async def return_book(self, user: User, identify: int) -> int:
+        """
+        Returns book to catalog.
+        """
+        return await self.call(self.interface.return_book, user, identify)
+
+    async def update_borrow(self, user: User, identify: int) -> int:
+        """
+        Updates book status.
+        """
+        return await self.call(self.interface.update_borrow, user, identify)
+
+    async def borrow_many(self, operations) -> list:
+        """
+        Borrows many books.
+        """
+        return await self.call(self.interface.borrow_many, operations)
+
+    async def return_many(self, operations) -> list:
+        """
+        Returns many books to catalog.
+        """
+        return await self.call(self.interface.return_many, operations)
+
+    async def read(self, filename: str) -> int:
+        """
+        Imports books from file.
+        """
+        return await self.run(self.interface.read, filename)
+
+    async def read_many(self, filenames: list, workers: int = None) -> list:
+        """
+        Imports books from many files.
+        """
+        return await self.run(self.interface.read_many, filenames, workers)
+
+    async def notifications(self, user: User):
+        """
+        Streams notifications of given user.
+        """
+        loop = asyncio.get_running_loop()
+        if self.loop is None or self.loop.is_closed():
+            self.loop = loop
+        elif self.loop is not loop:
+            raise RuntimeError("Notifications are bound to another event loop.")
+        inbox = asyncio.Queue()
+        self.streams.setdefault(user.name, set()).add(inbox)
+        try:
+            while True:
+                text = await inbox.get()
+                if text is None:
+                    return
+                yield text
+        finally:
+            self.streams[user.name].discard(inbox)
+            if not self.streams[user.name]:
+                del self.streams[user.name]
+
+    def close_notifications(self, user: User):
+        """
+        Ends notification streams of given user.
+        """
+        self.deliver(user, None)
+
+    def deliver(self, user: User, text: str):
+        """
+        Puts notification into user's streams, from any thread.
+        """
+        queues = self.streams.get(user.name)
+        if not queues or self.loop is None or self.loop.is_closed():
+            # Nobody can read notification anymore
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        for inbox in list(queues):
+            if running is self.loop:
+                inbox.put_nowait(text)
+                continue
+            try:
+                self.loop.call_soon_threadsafe(inbox.put_nowait, text)
+            except RuntimeError:
+                # Loop was closed in the meantime
+                return
@@ -1,15 +1,30 @@
 """
 Test file for main.py; use with pytest.
 """
+import asyncio
 import os
+import sys
+import threading
+import time
 
 from main import (
     ActionInterface,
+    AsyncActionInterface,
     Book,
+    ColumnStore,
     DataAdapter,
+    DictStore,
+    Instrumentation,
+    Journal,
+    JsonStream,
     LibraryCatalog,
+    NotificationDispatcher,
     ObserverManager,
+    ShardedActionInterface,
+    SqliteStore,
+    Teacher,
     UserFactory,
+    UserRegistry,
 )
 
 cat = LibraryCatalog()
@@ -276,3 +291,1177 @@ H,7,2002"""
         got = len(cat.get_catalog())
         assert expect == got
         print("Test 20 - json adapter")
+
+    def test_21_catalog_index(self):
+        """
+        Test 21.
+        """
+        expect = [True, 9, -3]
+        got = []
+        got.append(cat.find(3) == Book("D", 3, 2020))
+        got.append(len(cat.store))
+        got.append(interface.borrow_book(users[2], 999))
+        assert expect == got
+        print("Test 21 - catalog index")
+
+    def test_22_observers_waitlist_index(self):
+        """
+        Test 22.
+        """
+        expect = [0, 0, ["AAA", "BBB"], 1, ["BBB"]]
+        got = []
+        interface.borrow_book(users[2], 2)
+        got.append(interface.borrow_book(users[0], 2))
+        got.append(interface.borrow_book(users[1], 2))
+        got.append(list(manager.waiters[2].keys()))
+        got.append(manager.deattach(users[0], cat.find(2)))
+        got.append(list(manager.waiters[2].keys()))
+        assert expect == got
+        print("Test 22 - waitlist index")
+
+    def test_23_catalog_page(self):
+        """
+        Test 23.
+        """
+        expect = [
+            ["A, 1999, id 0, count: 1/1", "B, 2002, id 1, count: 0/1"],
+            ["J, 2021, id 9, count: 1/1"],
+            [],
+            10,
+            ["Page size must be positive."] * 2,
+        ]
+        got = []
+        batch, token = interface.show_books(None, 2)
+        got.append(batch)
+        for _ in range(4):
+            _, token = cat.page(token, 2)
+        cat.add_book(Book("J", 9, 2021))
+        batch, token = interface.show_books(token, 2)
+        got.append(batch)
+        got.append(interface.show_books(token, 2)[0])
+        got.append(len(list(cat)))
+        got.append([])
+        for size in (0, -2):
+            try:
+                cat.page("4", size)
+            except ValueError as e:
+                got[-1].append(str(e))
+        assert expect == got
+        print("Test 23 - catalog pages")
+
+    def test_24_adapter_xml_bad_records(self):
+        """
+        Test 24.
+        """
+        expect = [1, 2, 11, "K"]
+        with open("test_xml.xml", "w", encoding="utf-8") as f:
+            f.write(
+                """<?xml version="1.0"?>
+    <data>
+        <book>
+            <name>K</name>
+            <id>10</id>
+            <year>2001</year>
+        </book>
+        <book>
+            <name>L</name>
+            <id>eleven</id>
+            <year>2001</year>
+        </book>
+        <book>
+            <name>M</name>
+            <year>2001</year>
+        </book>
+    </data>"""
+            )
+        got = []
+        got.append(adapter.read(cat, "test_xml.xml"))
+        os.remove("test_xml.xml")
+        got.append(adapter.mistakes)
+        got.append(len(cat.get_catalog()))
+        got.append(cat.find(10).name)
+        assert expect == got
+        print("Test 24 - xml adapter bad records")
+
+    def test_25_add_books(self):
+        """
+        Test 25.
+        """
+        expect = [{1: 3, 2: 2}, [3, 3], [2, 2], [3, 3]]
+        got = []
+        got.append(
+            interface.add_books(
+                [
+                    Book("N", 12, 2010),
+                    Book("K", 10, 2001),
+                    Book("N", 12, 2010),
+                    Book("O", 13, 2011),
+                    Book("K", 10, 2001),
+                ]
+            )
+        )
+        got.append(cat.get_catalog()[cat.find(10)])
+        got.append(cat.get_catalog()[cat.find(12)])
+        cat.add_books([Book("O", 13, 2011), Book("O", 13, 2011)])
+        got.append(cat.get_catalog()[cat.find(13)])
+        assert expect == got
+        print("Test 25 - bulk add")
+
+    def test_26_adapter_read_many(self):
+        """
+        Test 26.
+        """
+        expect = [[6, 11, -1, -2, -2, -2], 0, 41, [2, 2]]
+        with open("test_many.csv", "w", encoding="utf-8") as f:
+            f.write("name,id,year\n")
+            for i in range(100, 140):
+                f.write(f"P{i},{i},2000\n")
+        with open("test_many.json", "w", encoding="utf-8") as f:
+            f.write('{"books": [{"name": "I", "id": 8, "year": 2016}]}')
+        with open("test_broken.json", "w", encoding="utf-8") as f:
+            f.write('{"books": [{"name": "J", "id": 9000, "year": 2016}, {"name"')
+        with open("test_nobooks.json", "w", encoding="utf-8") as f:
+            f.write('{"other": [{"name": "K", "id": 9001, "year": 2016}]}')
+        got = []
+        size = len(cat.get_catalog())
+        reader = DataAdapter(chunk_size=64)
+        # Missing and broken files get their own status, other files are still read
+        files = ["test_many.csv", "test_many.json", "test.txt"]
+        files += ["test_missing.json", "test_broken.json", "test_nobooks.json"]
+        got.append(reader.read_many(cat, files, 2))
+        os.remove("test_many.csv")
+        os.remove("test_many.json")
+        os.remove("test_broken.json")
+        os.remove("test_nobooks.json")
+        got.append(reader.mistakes)
+        got.append(len(cat.get_catalog()) - size)
+        got.append(cat.get_catalog()[cat.find(8)])
+        assert expect == got
+        print("Test 26 - parallel adapter")
+
+    def test_27_adapter_json_lines(self):
+        """
+        Test 27.
+        """
+        expect = [10, 2, ["Q", "R"], 2, 11, [4, 4], True]
+        with open("test_jsonl.jsonl", "w", encoding="utf-8") as f:
+            f.write('{"name": "Q", "id": 200, "year": 2003}\n\n{"name": "R"}\nnot json\n')
+            f.write('{"name": "R", "id": 201, "year": 2004}\n')
+        with open("test_json.json", "w", encoding="utf-8") as f:
+            f.write('{"source": {"books": [1]}, "books" : [ {"name": "I", "id": 8, ')
+            f.write('"year": 2016} ,{"name": "I", "id": 8, "year": 2016}], "total": 12345}')
+        got = []
+        got.append(adapter.read(cat, "test_jsonl.jsonl"))
+        os.remove("test_jsonl.jsonl")
+        got.append(adapter.mistakes)
+        got.append([cat.find(200).name, cat.find(201).name])
+        with open("test_json.json", "r", encoding="utf-8") as f:
+            got.append(len(list(JsonStream(f, 7).items("books"))))
+        got.append(adapter.read(cat, "test_json.json"))
+        os.remove("test_json.json")
+        got.append(cat.get_catalog()[cat.find(8)])
+        # Malformed record is reported without reading the rest of file
+        with open("test_json.json", "w", encoding="utf-8") as f:
+            f.write('{"books": [{"name": oops}')
+            f.write(', {"name": "I", "id": 8, "year": 2016}' * 1000 + "]}")
+        with open("test_json.json", "r", encoding="utf-8") as f:
+            try:
+                list(JsonStream(f, 64).items("books"))
+            except ValueError:
+                got.append(f.tell() < 1000)
+        os.remove("test_json.json")
+        assert expect == got
+        print("Test 27 - json lines adapter")
+
+    def test_28_compact_store(self):
+        """
+        Test 28.
+        """
+        expect = [
+            {1: 1, 2: 300},
+            [2, 2],
+            1,
+            "T7, 2007, id 7, count: 1/2",
+            [True, False],
+            ["T299, 2099, id 299, count: 1/1"],
+            1,
+            [2, 2],
+            [True, True, 300, 300],
+        ]
+        saved = cat.store
+        cat.use_store(ColumnStore())
+        books = [Book(f"T{i}", i, 2000 + i % 100) for i in range(300)]
+        got = []
+        got.append(interface.add_books(books + [Book("T7", 7, 2007)]))
+        got.append(cat.get_catalog()[Book("T7", 7, 2007)])
+        got.append(interface.borrow_book(users[2], 7))
+        got.append(cat.describe(cat.find(7)))
+        got.append(
+            [
+                Book("T5", 5, 2005) in cat.get_catalog(),
+                Book("T5", 5, 1) in cat.get_catalog(),
+            ]
+        )
+        got.append(interface.show_books("12b", 5)[0])
+        got.append(interface.return_book(users[2], 7))
+        got.append(cat.get_catalog()[Book("T7", 7, 2007)])
+        # Bad values are refused before any column grows
+        refused = []
+        for book in (Book("T", "x", 2000), Book("T", 900, 2**40)):
+            try:
+                cat.store.insert(book, 1)
+            except (TypeError, OverflowError):
+                refused.append(True)
+        got.append(refused + [len(cat.store), len(cat.store.names)])
+        cat.use_store(saved)
+        assert expect == got
+        print("Test 28 - compact store")
+
+    def test_29_snapshot(self):
+        """
+        Test 29.
+        """
+        expect = [True, [True, True, True], [["C"]], True, [1, True], True]
+        interface.borrow_book(users[1], 6)
+        cat.save_snapshot("test_snapshot.bin", users, manager)
+        before = dict(cat.get_catalog())
+        saved = cat.store
+        waiting = ObserverManager()
+        loaded = cat.load_snapshot("test_snapshot.bin", waiting)
+        got = []
+        got.append(dict(cat.get_catalog()) == before)
+        got.append([i.books == j.books for i, j in zip(users, loaded)])
+        got.append([[j.name for j in i.books] for i in waiting.observers])
+        cat.use_store(ColumnStore())
+        cat.load_snapshot("test_snapshot.bin")
+        got.append(dict(cat.get_catalog()) == before)
+        got.append([interface.borrow_book(loaded[2], 7), len(cat.store.table) > 16])
+        cat.save_snapshot("test_snapshot.bin")
+        cat.use_store(ColumnStore())
+        cat.load_snapshot("test_snapshot.bin")
+        os.remove("test_snapshot.bin")
+        got.append(cat.find(6) == Book("G", 6, 2012))
+        cat.use_store(saved)
+        assert expect == got
+        print("Test 29 - snapshot")
+
+    def test_30_journal(self):
+        """
+        Test 30.
+        """
+        expect = [1, {"AAA": {}, "BBB": {"V": "Borrowed"}}, ["AAA"], True, 1]
+        saved = cat.store
+        cat.use_store(DictStore())
+        log = Journal("test_journal.log", sync_every=2)
+        desk = ActionInterface(cat, ObserverManager())
+        log.recover(cat, desk.manager, "test_journal.bin")
+        reader, writer = factory.create_user("student", "AAA"), Teacher("BBB")
+        desk.add_books([Book("U", 300, 1990), Book("V", 301, 1991)])
+        desk.borrow_book(writer, 301)
+        desk.update_borrow(writer, 301)
+        desk.borrow_book(reader, 301)
+        desk.borrow_book(reader, 300)
+        desk.return_book(reader, 300)
+        log.compact(cat, "test_journal.bin", [reader, writer], desk.manager)
+        desk.add_book(Book("V", 301, 1991))
+        # Record torn by crash
+        log.file.write('["R", "student"')
+        log.close()
+        before = dict(cat.get_catalog())
+        got = [log.generation]
+        cat.use_store(DictStore())
+        cat.generation = 0
+        waiting = ObserverManager()
+        log = Journal("test_journal.log")
+        restored = log.recover(cat, waiting, "test_journal.bin")
+        got.append({i.name: {j.name: k for j, k in i.books.items()} for i in restored})
+        got.append(list(waiting.waiters[301]))
+        got.append(dict(cat.get_catalog()) == before)
+        got.append(cat.generation)
+        log.close()
+        cat.journal = None
+        os.remove("test_journal.log")
+        os.remove("test_journal.bin")
+        cat.use_store(saved)
+        assert expect == got
+        print("Test 30 - journal")
+
+    def test_31_concurrent_borrow(self):
+        """
+        Test 31.
+        """
+        expect = [[], True]
+        saved = cat.store
+        cat.use_store(ColumnStore())
+        desk = ActionInterface(cat, ObserverManager())
+        desk.add_books([Book(f"W{i % 40}", 400 + i % 40, 2000) for i in range(80)])
+        readers = [factory.create_user("librarian", f"R{i}") for i in range(16)]
+        overlent = []
+        switch = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+
+        def work(number):
+            for step in range(200):
+                identify = 400 + (step * 7 + number) % 40
+                if desk.borrow_book(readers[number], identify) == 1:
+                    if cat.store.counts(cat.find(identify))[0] < 0:
+                        overlent.append(identify)
+                if step % 3 == 0:
+                    desk.return_book(readers[number], identify)
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(16)]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            # Tiny interval must not leak into later tests
+            sys.setswitchinterval(switch)
+        got = [overlent]
+        lent = [0] * 40
+        for reader in readers:
+            for book in reader.books:
+                lent[book.identify - 400] += 1
+        got.append(
+            all(
+                cat.store.counts(cat.find(400 + i))[0] + lent[i] == 2 for i in range(40)
+            )
+        )
+        cat.use_store(saved)
+        assert expect == got
+        print("Test 31 - concurrent borrows")
+
+    def test_32_async_interface(self):
+        """
+        Test 32.
+        """
+        expect = [
+            [2, 1, 0],
+            ["User AS2 wishlisted book Async, 2024, id 501."],
+            [1, 1],
+            ["User AS2 - book Async, 2024, id 501 is available."],
+            [1] * 300,
+            [0, 1],
+            {True},
+        ]
+        saved = cat.store
+        cat.use_store(DictStore())
+        manager = ObserverManager()
+        desk = AsyncActionInterface(cat, manager)
+        # Lending runs in event loop's thread instead of executor
+        threads = set()
+        manager.listeners.append(
+            lambda user, text: threads.add(
+                threading.current_thread() is threading.main_thread()
+            )
+        )
+        first = factory.create_user("librarian", "AS1")
+        second = factory.create_user("librarian", "AS2")
+        got = []
+
+        async def listen():
+            return [text async for text in desk.notifications(second)]
+
+        async def run():
+            stream = asyncio.ensure_future(listen())
+            await asyncio.sleep(0)
+            got.append(
+                [
+                    await desk.add_book(Book("Async", 501, 2024)),
+                    await desk.borrow_book(first, 501),
+                    await desk.borrow_book(second, 501),
+                ]
+            )
+            await desk.return_book(first, 501)
+            got.append([await desk.borrow_book(second, 501), len(cat.catalog)])
+            desk.close_notifications(second)
+            await stream
+            readers = [factory.create_user("librarian", f"AR{i}") for i in range(300)]
+            await desk.add_books([Book("Crowd", 502, 2024)] * 300)
+            return stream.result(), await asyncio.gather(
+                *(desk.borrow_book(i, 502) for i in readers)
+            )
+
+        messages, codes = asyncio.run(run())
+        got.insert(1, messages[:1])
+        got.append(messages[1:])
+        got.append(codes)
+        # Stream left open when its loop was closed does not break lending
+        desk.streams[first.name] = {asyncio.Queue()}
+        got.append(
+            [
+                desk.interface.borrow_book(first, 501),
+                desk.interface.return_book(second, 501),
+            ]
+        )
+        got.append(threads)
+        cat.use_store(saved)
+        assert expect == got
+        print("Test 32 - async interface")
+
+    def test_33_batch_operations(self):
+        """
+        Test 33.
+        """
+        saved = cat.store
+        cat.use_store(DictStore())
+        desk = ActionInterface(cat, ObserverManager())
+        desk.add_books([Book("Batch", 601, 2001)] * 2 + [Book("Single", 602, 2002)])
+        first = factory.create_user("student", "BA1")
+        second = factory.create_user("student", "BA2")
+        waiting = factory.create_user("student", "BA3")
+        operations = [
+            (first, 601),
+            (second, 601),
+            (first, 602),
+            (first, 601),
+            (second, 602),
+            (first, 603),
+        ]
+        expect = [
+            [1, 1, 1, -2, 0, -3],
+            [0, 0],
+            [1, 1, -2, 1, -1],
+            [
+                "User BA3 wishlisted book Batch, 2001, id 601.",
+                "User: BA3 added book Single, 2002, id 602 to wishlist.",
+                "User BA3 - book Batch, 2001, id 601 is available.",
+                "User BA3 - book Single, 2002, id 602 is available.",
+            ],
+        ]
+        got = [desk.borrow_many(operations)]
+        got.append([desk.borrow_book(waiting, 601), desk.borrow_book(waiting, 602)])
+        got.append(
+            desk.return_many(
+                [(first, 601), (second, 601), (first, 601), (first, 602), (second, 602)]
+            )
+        )
+        got.append(desk.manager.observers[-1].infos)
+        cat.use_store(saved)
+        assert expect == got
+        print("Test 33 - batch operations")
+
+    def test_34_bounded_notifications(self):
+        """
+        Test 34.
+        """
+        expect = [
+            3,
+            [
+                "User NB1 - book Bounded, 2003, id 701 is available.",
+                "User NB1 - book Bounded, 2003, id 701 is available.",
+                "User NB1 - book Bounded, 2003, id 701 is available.",
+            ],
+            [],
+            ["User NB1 - book Bounded, 2003, id 701 is available."],
+            ["User NB1 - book Bounded, 2003, id 701 is available."] * 3,
+            [-1, []],
+        ]
+        waiting = ObserverManager(capacity=3)
+        book = Book("Bounded", 701, 2003)
+        user = factory.create_user("student", "NB1")
+        waiting.attach(user, book)
+        for _ in range(10):
+            waiting.notify(book)
+        observer = waiting.observers[-1]
+        got = [len(observer.events), observer.get_unread(), observer.get_unread()]
+        waiting.notify(book)
+        got.append(observer.get_unread())
+        got.append(observer.get_infos())
+        # Repeated wish leaves no notification
+        got.append([waiting.attach(user, book), observer.get_unread()])
+        assert expect == got
+        print("Test 34 - bounded notifications")
+
+    def test_35_notification_dispatcher(self):
+        """
+        Test 35.
+        """
+        expect = [
+            [1, 0, 0, 1],
+            [
+                "User ND2 wishlisted book Queued, 2004, id 801.",
+                "User ND2 - book Queued, 2004, id 801 is available.",
+            ],
+            {
+                "depth": 0,
+                "capacity": 8,
+                "submitted": 1,
+                "delivered": 1,
+                "coalesced": 0,
+                "failed": 0,
+            },
+            [1, 1, 1],
+            [False, False],
+            [4, 2],
+        ]
+        saved = cat.store
+        cat.use_store(DictStore())
+        desk = ActionInterface(cat, ObserverManager())
+        dispatcher = NotificationDispatcher(workers=2, size=8)
+        desk.manager.dispatcher = dispatcher
+        desk.add_book(Book("Queued", 801, 2004))
+        owner = factory.create_user("student", "ND1")
+        waiting = [factory.create_user("student", f"ND{i}") for i in range(2, 4)]
+        got = [[desk.borrow_book(owner, 801)]]
+        got[0].extend(desk.borrow_book(i, 801) for i in waiting)
+        got[0].append(desk.return_book(owner, 801))
+        dispatcher.flush()
+        got.append(desk.manager.users["ND2"].infos)
+        metrics = dispatcher.metrics()
+        del metrics["peak"]
+        got.append(metrics)
+
+        def broken(user, text):
+            raise RuntimeError("Listener is gone.")
+
+        # Failing listener neither kills worker nor hangs flush()
+        desk.manager.listeners.append(broken)
+        got.append([desk.borrow_book(owner, 801), desk.return_book(owner, 801)])
+        dispatcher.flush()
+        got[-1].append(dispatcher.metrics()["failed"])
+        desk.manager.listeners.remove(broken)
+        dispatcher.shutdown()
+        got.append([i.is_alive() for i in dispatcher.threads])
+        # After shutdown observers are notified right away
+        desk.borrow_book(owner, 801)
+        desk.return_book(owner, 801)
+        got.append(
+            [len(desk.manager.users["ND2"].infos), dispatcher.metrics()["submitted"]]
+        )
+        cat.use_store(saved)
+        assert expect == got
+        print("Test 35 - notification dispatcher")
+
+    def test_36_instrumentation(self):
+        """
+        Test 36.
+        """
+        expect = [
+            {
+                "add_book": {2: 1},
+                "borrow_book": {1: 1, 0: 1, -3: 1},
+                "return_book": {1: 1},
+            },
+            3,
+            {
+                "catalog_titles": 1,
+                "observers": 1,
+                "waited_titles": 1,
+                "waitlist_entries": 1,
+            },
+            True,
+            True,
+            [{1: 2, 2: 1}, {11: 1, -1: 1}],
+        ]
+        saved = cat.store
+        cat.use_store(DictStore())
+        metrics = Instrumentation()
+        desk = ActionInterface(cat, ObserverManager(), metrics)
+        owner = factory.create_user("student", "IN1")
+        waiting = factory.create_user("student", "IN2")
+        desk.add_book(Book("Measured", 901, 2005))
+        desk.borrow_book(owner, 901)
+        desk.borrow_book(waiting, 901)
+        desk.borrow_book(owner, 902)
+        desk.return_book(owner, 901)
+        snapshot = metrics.snapshot()
+        got = [snapshot["codes"], snapshot["latency"]["borrow_book"]["count"]]
+        got.append(snapshot["gauges"])
+        text = metrics.prometheus()
+        got.append('library_operation_seconds_count{operation="borrow_book"} 3' in text)
+        got.append(
+            'library_operation_results_total{operation="borrow_book",code="-3"} 1'
+            in text
+        )
+        # Imports are measured too
+        desk.add_books([Book("Batch", 903, 2005)] * 2 + [Book("Measured", 901, 2005)])
+        with open("test_measured.json", "w", encoding="utf-8") as f:
+            f.write('{"books": [{"name": "File", "id": 904, "year": 2005}]}')
+        desk.read_many(["test_measured.json", "test.txt"], 1)
+        os.remove("test_measured.json")
+        codes = metrics.snapshot()["codes"]
+        got.append([codes["add_books"], codes["read_many"]])
+        cat.use_store(saved)
+        assert expect == got
+        print("Test 36 - instrumentation")
+
+    def test_37_search(self):
+        """
+        Test 37.
+        """
+        expect = [
+            [Book("The Old Man and the Sea", 1002, 1952)],
+            [
+                Book("Sea of Stars", 1001, 1990),
+                Book("The Old Man and the Sea", 1002, 1952),
+            ],
+            [Book("Old Times", 1003, 1960)],
+            [
+                Book("The Old Man and the Sea", 1002, 1952),
+                Book("Old Times", 1003, 1960),
+            ],
+            ["Seasons, 2001, id 1004, count: 1/1"],
+            [],
+            [Book("Seasons", 1004, 2001), Book("Seaside", 1040, 2002)],
+        ]
+        saved = cat.store
+        cat.use_store(DictStore())
+        desk = ActionInterface(cat, ObserverManager())
+        desk.add_books(
+            [
+                Book("Sea of Stars", 1001, 1990),
+                Book("The Old Man and the Sea", 1002, 1952),
+                Book("Old Times", 1003, 1960),
+            ]
+        )
+        got = [cat.search(title="sea old")]
+        got.append(cat.search(title="SEA"))
+        got.append(cat.search(prefix="tim"))
+        got.append(cat.search(prefix="old", start=1950, stop=1960))
+        desk.add_book(Book("Seasons", 1004, 2001))
+        got.append(desk.search_books(prefix="sea", start=2000))
+        got.append(cat.search(title="sea", stop=1900))
+        # Single new word is inserted into big vocabulary instead of sorting it again
+        desk.add_books([Book(f"Filler {i}", 1005 + i, 1900) for i in range(35)])
+        desk.add_book(Book("Seaside", 1040, 2002))
+        got.append(cat.search(prefix="seas"))
+        cat.use_store(saved)
+        assert expect == got
+        print("Test 37 - search")
+
+    def test_38_user_registry(self):
+        """
+        Test 38.
+        """
+        expect = [
+            [1, 2],
+            ["RG2", "RG1", None],
+            "User RG1 is already registered.",
+            [-2, 1, 1, 1, 0],
+            [Book("Registered", 1102, 2006), None],
+        ]
+        saved = cat.store
+        cat.use_store(DictStore())
+        registry = UserRegistry()
+        people = UserFactory(registry)
+        desk = ActionInterface(cat, ObserverManager())
+        desk.add_books([Book("Indexed", 1101, 2006), Book("Registered", 1102, 2006)])
+        first = people.create_user("librarian", "RG1")
+        second = people.create_user("teacher", "RG2")
+        got = [[first.identify, second.identify]]
+        got.append(
+            [registry.by_id(2).name, registry.get("RG1").name, registry.get("RG3")]
+        )
+        try:
+            people.create_user("student", "RG1")
+        except ValueError as e:
+            got.append(str(e))
+        desk.borrow_book(first, 1101)
+        desk.borrow_book(first, 1102)
+        desk.update_borrow(first, 1101)
+        got.append(
+            [
+                desk.borrow_book(first, 1101),
+                desk.return_book(first, 1101),
+                len(first.books),
+                first.count("Ordered"),
+                first.count("Borrowed"),
+            ]
+        )
+        got.append([first.loan(1102), first.loan(1101)])
+        cat.use_store(saved)
+        assert expect == got
+        print("Test 38 - user registry")
+
+    def test_39_sharded_interface(self):
+        """
+        Test 39.
+        """
+        expect = [
+            {1: 1, 2: 7},
+            [1, 1, 1, 1, 1, -1],
+            [0, 1, -2, -3, -2],
+            [1, -1, 1],
+            {1: "Borrowed", 2: "Ordered", 3: "Ordered", 4: "Ordered"},
+            [1, 1, -1],
+            [
+                "User SH2 wishlisted book Shard 1, 2000, id 1.",
+                "User SH2 - book Shard 1, 2000, id 1 is available.",
+            ],
+            [1, "Borrowed"],
+            {
+                Book("Shard 0", 0, 2000): [2, 2],
+                Book("Shard 1", 1, 2000): [1, 1],
+                Book("Shard 2", 2, 2000): [0, 1],
+                Book("Shard 3", 3, 2000): [0, 1],
+                Book("Shard 4", 4, 2000): [0, 1],
+                Book("Shard 5", 5, 2000): [1, 1],
+                Book("Shard 6", 6, 2000): [1, 1],
+            },
+        ]
+        reader = factory.create_user("student", "SH1")
+        waiting = factory.create_user("student", "SH2")
+        with ShardedActionInterface(shards=3) as desk:
+            got = [
+                desk.add_books(
+                    [Book(f"Shard {i}", i, 2000) for i in range(7)]
+                    + [Book("Shard 0", 0, 2000)]
+                )
+            ]
+            # Five books from three shards reach limit of student
+            got.append(desk.borrow_many([(reader, i) for i in range(6)]))
+            got.append(
+                [
+                    desk.borrow_book(waiting, 1),
+                    desk.borrow_book(waiting, 0),
+                    desk.return_book(reader, 6),
+                    desk.return_book(reader, 9),
+                    desk.return_book(waiting, 1),
+                ]
+            )
+            got.append(
+                [
+                    desk.update_borrow(reader, 1),
+                    desk.update_borrow(reader, 1),
+                    desk.return_book(reader, 0),
+                ]
+            )
+            got.append({i.identify: j for i, j in reader.books.items()})
+            got.append(desk.return_many([(reader, 1), (waiting, 0), (waiting, 3)]))
+            got.append(desk.get_infos(waiting))
+            # Another object with the same name acts on the same user
+            twin = factory.create_user("student", "SH1")
+            got.append(
+                [desk.update_borrow(twin, 2), reader.books[Book("Shard 2", 2, 2000)]]
+            )
+            got.append(desk.show_catalog())
+        assert expect == got
+        print("Test 39 - sharded interface")
+
+    def test_40_write_catalog(self):
+        """
+        Test 40.
+        """
+        saved = cat.store
+        cat.use_store(DictStore())
+        desk = ActionInterface(cat, ObserverManager())
+        desk.add_books(
+            [Book("Export", 1201, 2007)] * 3
+            + [Book('Quotes "and" <tags>, commas', 1202, 2008)]
+        )
+        desk.borrow_book(factory.create_user("student", "WR1"), 1201)
+        expect = [[2, 2, 2, 2, -1], {Book("Export", 1201, 2007): [3, 3]}]
+        expect[1][Book('Quotes "and" <tags>, commas', 1202, 2008)] = [1, 1]
+        expect.extend([expect[1]] * 3)
+        expect.append([(Book("Huge", 1203, 2009), 10_000_000)])
+        adapter = DataAdapter(batch_size=1)
+        names = ["test_out.csv", "test_out.jsonl", "test_out.json", "test_out.xml"]
+        got = [[adapter.write(cat, i) for i in names + ["test_out.txt"]]]
+        for name in names:
+            cat.use_store(DictStore())
+            adapter.read(cat, name)
+            got.append(dict(cat.get_catalog()))
+            os.remove(name)
+        # Many copies come as one book with its count
+        with open("test_out.csv", "w", encoding="utf-8") as f:
+            f.write("name,id,year,total\nHuge,1203,2009,10000000\n")
+        got.append(list(adapter.records("test_out.csv")))
+        os.remove("test_out.csv")
+        cat.use_store(saved)
+        assert expect == got
+        print("Test 40 - write catalog")
+
+    def test_41_csv_rejects(self):
+        """
+        Test 41.
+        """
+        expect = [
+            5,
+            {Book("Good", 1301, 2009): [1, 1], Book("Copies", 1304, 2010): [2, 2]},
+            [
+                "line,error,row",
+                "3,ValueError: invalid literal for int() with base 10: 'x',Bad,x,2009,",
+                "4,IndexError: list index out of range,Short,1303",
+                "7,ValueError: total 0 is not positive,None,1305,2011,0",
+            ],
+            [5, {}, "2,KeyError: 'missing column year',Good,1301"],
+        ]
+        saved = cat.store
+        cat.use_store(DictStore())
+        with open("test_rejects.csv", "w", encoding="utf-8") as f:
+            f.write("name,id,year,total\n")
+            f.write("Good,1301,2009,\n")
+            f.write("Bad,x,2009,\n")
+            f.write("Short,1303\n")
+            f.write("\n")
+            f.write("Copies,1304,2010,2\n")
+            f.write("None,1305,2011,0\n")
+        reader = DataAdapter(batch_size=2, rejects="test_rejects.txt")
+        got = [reader.read(cat, "test_rejects.csv"), dict(cat.get_catalog())]
+        with open("test_rejects.txt", "r", encoding="utf-8") as f:
+            got.append(f.read().splitlines())
+        cat.use_store(DictStore())
+        with open("test_rejects.csv", "w", encoding="utf-8") as f:
+            f.write("name,id\nGood,1301\n")
+        got.append([reader.read(cat, "test_rejects.csv"), dict(cat.get_catalog())])
+        with open("test_rejects.txt", "r", encoding="utf-8") as f:
+            got[-1].append(f.read().splitlines()[1])
+        os.remove("test_rejects.csv")
+        os.remove("test_rejects.txt")
+        cat.use_store(saved)
+        assert expect == got
+        print("Test 41 - csv rejects")
+
+    def test_42_sqlite_store(self):
+        """
+        Test 42.
+        """
+        expect = [
+            [2, 1, 2, 1, 1, 0, 1, 1],
+            {Book("Disk", 1401, 2012): [1, 2], Book("Table", 1402, 2013): [1, 1]},
+            [Book("Table", 1402, 2013)],
+            [True, 2],
+            [2, Book("Disk", 1401, 2012), (1, 2)],
+        ]
+        saved = cat.store
+        store = SqliteStore("test_store.db")
+        cat.use_store(store)
+        desk = ActionInterface(cat, ObserverManager())
+        first = factory.create_user("student", "SQ1")
+        second = factory.create_user("student", "SQ2")
+        got = [
+            [
+                desk.add_book(Book("Disk", 1401, 2012)),
+                desk.add_book(Book("Disk", 1401, 2012)),
+                desk.add_book(Book("Table", 1402, 2013)),
+                desk.borrow_book(first, 1401),
+                desk.borrow_book(first, 1402),
+                desk.borrow_book(second, 1402),
+                desk.return_book(first, 1402),
+                desk.update_borrow(first, 1401),
+            ]
+        ]
+        got.append(dict(cat.get_catalog()))
+        got.append(cat.search(prefix="tab"))
+        # Snapshot is loaded into the same database, dropping book added after saving it
+        cat.save_snapshot("test_store.bin", [])
+        desk.add_book(Book("Late", 1403, 2014))
+        cat.load_snapshot("test_store.bin")
+        os.remove("test_store.bin")
+        got.append([cat.store is store, len(store)])
+        store.close()
+        # Catalog is still there after reopening the file
+        store = SqliteStore("test_store.db")
+        got.append(
+            [len(store), store.find(1401), store.counts(Book("Disk", 1401, 2012))]
+        )
+        store.close()
+        for name in ("test_store.db", "test_store.db-wal", "test_store.db-shm"):
+            if os.path.exists(name):
+                os.remove(name)
+        cat.use_store(saved)
+        assert expect == got
+        print("Test 42 - sqlite store")
+
+    def test_43_reservations(self):
+        """
+        Test 43.
+        """
+        expect = [
+            [1, 0, 0, 0, 1, 0, 1, 1],
+            ["User LIB - book Wanted, 2015, id 1500 is reserved for you."],
+            [],
+            {1500: {"TEA": Book("Wanted", 1500, 2015)}},
+            [0, 0],
+            [{1500: {"TEA": Book("Wanted", 1500, 2015)}}, ["STU"], [0, 1], 1, {}],
+        ]
+        saved = cat.store
+        cat.use_store(DictStore())
+        cat.generation = 0
+        log = Journal("test_reserve.log")
+        desk = ActionInterface(cat, ObserverManager(reservations=True))
+        log.recover(cat, desk.manager, "test_reserve.bin")
+        owner, student = [factory.create_user("student", i) for i in ("OWN", "STU")]
+        teacher, librarian = Teacher("TEA"), factory.create_user("librarian", "LIB")
+        desk.add_book(Book("Wanted", 1500, 2015))
+        got = [
+            [
+                desk.borrow_book(owner, 1500),
+                desk.borrow_book(student, 1500),
+                desk.borrow_book(teacher, 1500),
+                desk.borrow_book(librarian, 1500),
+                # Librarian goes first, although it waits the shortest
+                desk.return_book(owner, 1500),
+                desk.borrow_book(student, 1500),
+                desk.borrow_book(librarian, 1500),
+                desk.return_book(librarian, 1500),
+            ]
+        ]
+        got.append(desk.manager.users["LIB"].get_unread()[-1:])
+        # Nobody else hears about returned copies
+        unread = desk.manager.users["STU"].get_unread()
+        got.append([i for i in unread if " is " in i])
+        got.append(desk.manager.holds)
+        got.append([cat.store.counts(cat.store.find(1500))[0], len(owner.books)])
+        log.close()
+        # Hold survives crash, but only for the teacher
+        cat.use_store(DictStore())
+        cat.generation = 0
+        waiting = ObserverManager(reservations=True)
+        log = Journal("test_reserve.log")
+        restored = {i.name: i for i in log.recover(cat, waiting, "test_reserve.bin")}
+        got.append(
+            [
+                {i: dict(j) for i, j in waiting.holds.items()},
+                list(waiting.waiters[1500]),
+                list(cat.store.counts(cat.store.find(1500))),
+                cat.borrow_book(restored["TEA"], 1500, waiting),
+                waiting.holds,
+            ]
+        )
+        log.close()
+        cat.journal = None
+        os.remove("test_reserve.log")
+        cat.use_store(saved)
+        assert expect == got
+        print("Test 43 - reservations")
+
+    def test_44_interrupted_compact(self):
+        """
+        Test 44.
+        """
+        expect = [0, 1, 1, {"Z": "Ordered"}, 0]
+        saved = cat.store
+        cat.use_store(DictStore())
+        cat.generation = 0
+        log = Journal("test_restart.log", sync_interval=0.01)
+        manager = ObserverManager()
+        log.recover(cat, manager, "test_restart.bin")
+        cat.add_book(Book("Z", 1600, 2016))
+        time.sleep(0.2)
+        # Last record was synced by timer, without any further record
+        got = [log.pending]
+        # Compaction saved snapshot, but crashed before starting new journal
+        log.sync()
+        cat.generation = log.generation + 1
+        cat.save_snapshot("test_restart.bin", [], manager)
+        log.close()
+        cat.use_store(DictStore())
+        log = Journal("test_restart.log")
+        log.recover(cat, ObserverManager(), "test_restart.bin")
+        reader = factory.create_user("student", "ZZZ")
+        got.append(cat.borrow_book(reader, 1600, ObserverManager()))
+        log.close()
+        # Loan made after the first restart survives the second one
+        cat.use_store(DictStore())
+        log = Journal("test_restart.log")
+        users = log.recover(cat, ObserverManager(), "test_restart.bin")
+        got.append(log.generation)
+        got.append({i.name: j for i, j in users[0].books.items()})
+        got.append(cat.store.counts(cat.store.find(1600))[0])
+        log.close()
+        cat.journal = None
+        os.remove("test_restart.log")
+        os.remove("test_restart.bin")
+        cat.use_store(saved)
+        assert expect == got
+        print("Test 44 - interrupted compact")
+
+    def test_45_release_hold(self):
+        """
+        Test 45.
+        """
+        expect = [[1, 1, 0, 0, 0], 1, ["RB"], [1, -1], ["RA"], -3, [1, {}, 1], -2]
+        saved = cat.store
+        cat.use_store(DictStore())
+        manager = ObserverManager(reservations=True)
+        owner = factory.create_user("student", "RO")
+        first, second = [factory.create_user("student", i) for i in ("RA", "RB")]
+        cat.add_books([Book("X", 1700, 2017), Book("Y", 1701, 2017)])
+        cat.add_book(Book("Z", 1702, 2017))
+        got = [
+            [
+                cat.borrow_book(owner, 1700, manager),
+                cat.borrow_book(owner, 1701, manager),
+                cat.borrow_book(first, 1701, manager),
+                cat.borrow_book(second, 1700, manager),
+                cat.borrow_book(first, 1700, manager),
+            ]
+        ]
+        # Second user waits for X longer, although first one started waiting earlier
+        cat.save_snapshot("test_hold.bin", [owner, first, second], manager)
+        manager = ObserverManager(reservations=True)
+        users = {i.name: i for i in cat.load_snapshot("test_hold.bin", manager)}
+        os.remove("test_hold.bin")
+        got.append(cat.return_book(users["RO"], 1700, manager))
+        got.append(list(manager.holds[1700]))
+        # User at book limit cannot take held copy, so it goes to the next waiter
+        users["RB"].limit = 1
+        got.append(
+            [
+                cat.borrow_book(users["RB"], 1702, manager),
+                cat.borrow_book(users["RB"], 1700, manager),
+            ]
+        )
+        got.append(list(manager.holds[1700]))
+        got.append(manager.deattach(users["RA"], Book("X", 1700, 2017)))
+        got.append(
+            [
+                cat.release(users["RA"], 1700, manager),
+                manager.holds,
+                cat.store.counts(cat.store.find(1700))[0],
+            ]
+        )
+        got.append(cat.release(users["RA"], 1700, manager))
+        cat.use_store(saved)
+        assert expect == got
+        print("Test 45 - release hold")
+
+    def test_46_rejected_book_journal(self):
+        """
+        Test 46.
+        """
+        expect = [True, [1800], [1800]]
+        saved = cat.store
+        cat.use_store(ColumnStore())
+        cat.generation = 0
+        log = Journal("test_rejected.log")
+        log.recover(cat, ObserverManager(), "test_rejected.bin")
+        cat.add_book(Book("Fits", 1800, 2018))
+        # Year too large for ColumnStore is rejected before reaching journal
+        try:
+            cat.add_book(Book("Huge", 1801, 2**40))
+            got = [False]
+        except OverflowError:
+            got = [True]
+        got.append([i.identify for i in cat.get_catalog()])
+        log.close()
+        cat.use_store(ColumnStore())
+        log = Journal("test_rejected.log")
+        log.recover(cat, ObserverManager(), "test_rejected.bin")
+        got.append([i.identify for i in cat.get_catalog()])
+        log.close()
+        cat.journal = None
+        os.remove("test_rejected.log")
+        cat.use_store(saved)
+        assert expect == got
+        print("Test 46 - rejected book journal")
+
+    def test_47_concurrent_compact(self):
+        """
+        Test 47.
+        """
+        expect = [[], True]
+        saved = cat.store
+        cat.use_store(DictStore())
+        cat.generation = 0
+        log = Journal("test_online.log")
+        manager = ObserverManager()
+        log.recover(cat, manager, "test_online.bin")
+        errors = []
+
+        def add(start):
+            try:
+                for i in range(start, start + 300):
+                    cat.add_book(Book(f"On{i % 50}", 1900 + i % 50, 2019))
+            except Exception as error:
+                errors.append(repr(error))
+
+        # Books keep coming while journal is compacted again and again
+        writers = [threading.Thread(target=add, args=(i * 300,)) for i in range(4)]
+        for i in writers:
+            i.start()
+        for _ in range(20):
+            log.compact(cat, "test_online.bin", [], manager)
+        for i in writers:
+            i.join()
+        got = [errors]
+        before = dict(cat.get_catalog())
+        log.close()
+        cat.use_store(DictStore())
+        cat.generation = 0
+        log = Journal("test_online.log")
+        log.recover(cat, ObserverManager(), "test_online.bin")
+        got.append(dict(cat.get_catalog()) == before)
+        log.close()
+        cat.journal = None
+        os.remove("test_online.log")
+        os.remove("test_online.bin")
+        cat.use_store(saved)
+        assert expect == got
+        print("Test 47 - concurrent compact")
+
+    def test_48_compact_known_users(self):
+        """
+        Test 48.
+        """
+        expect = [{"CU": {"Kept": "Ordered"}}, 0]
+        saved = cat.store
+        cat.use_store(DictStore())
+        cat.generation = 0
+        log = Journal("test_users.log")
+        manager = ObserverManager()
+        log.recover(cat, manager, "test_users.bin")
+        cat.add_book(Book("Kept", 2000, 2020))
+        cat.borrow_book(factory.create_user("student", "CU"), 2000, manager)
+        # Borrower is not listed, but journal remembers them
+        log.compact(cat, "test_users.bin", manager=manager)
+        log.close()
+        cat.use_store(DictStore())
+        cat.generation = 0
+        log = Journal("test_users.log")
+        users = log.recover(cat, ObserverManager(), "test_users.bin")
+        got = [{i.name: {j.name: k for j, k in i.books.items()} for i in users}]
+        got.append(cat.store.counts(cat.store.find(2000))[0])
+        log.close()
+        cat.journal = None
+        os.remove("test_users.log")
+        os.remove("test_users.bin")
+        cat.use_store(saved)
+        assert expect == got
+        print("Test 48 - compact known users")
+
+    def test_49_dispatcher_shutdown_wait(self):
+        """
+        Test 49.
+        """
+        expect = [True, [4], True, [1, 2, 3, 4]]
+        dispatcher = NotificationDispatcher(workers=1, size=1)
+        release = threading.Event()
+        delivered = []
+
+        class Slow:
+            def broadcast(self, book):
+                if book.identify != 4:
+                    release.wait()
+                delivered.append(book.identify)
+
+        slow = Slow()
+        # Worker is stuck on the first book and the second one fills the queue
+        dispatcher.submit(slow, Book("Slow", 1, 2021))
+        while dispatcher.events.qsize():
+            time.sleep(0.001)
+        dispatcher.submit(slow, Book("Slow", 2, 2021))
+        producer = threading.Thread(
+            target=dispatcher.submit, args=(slow, Book("Slow", 3, 2021))
+        )
+        producer.start()
+        while not dispatcher.entering:
+            time.sleep(0.001)
+        stopper = threading.Thread(target=dispatcher.shutdown)
+        stopper.start()
+        while not dispatcher.closed:
+            time.sleep(0.001)
+        # Producer waiting for free space does not hold up shutdown() or others at gate
+        got = [stopper.is_alive()]
+        dispatcher.submit(slow, Book("Fast", 4, 2021))
+        got.append(list(delivered))
+        release.set()
+        producer.join()
+        stopper.join()
+        got.append(dispatcher.metrics()["submitted"] == 3)
+        got.append(sorted(delivered))
+        assert expect == got
+        print("Test 49 - dispatcher shutdown wait")